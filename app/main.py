@@ -1,26 +1,44 @@
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 import os
 import uuid
+import json
+import time
 import logging
 import cv2
 import numpy as np
 from enum import Enum
 # from tools.pdf2card import pdf_to_images, extract_card_from_image
 # from tools.html2pdf import html_to_pdf
-from tools.selenium2img import html_to_image
-from tools.card_extractor import extract_card_from_image
+from tools.selenium2img import render_card_to_file, CAPTURE_ELEMENT, CARD_ELEMENT_MIN_AREA, CARD_CLIP_PADDING
+from tools.render_ready import RENDER_READY_TIMEOUT, RENDER_NETWORK_IDLE_MS, RENDER_RESIZE_READY_TIMEOUT
+from tools.browser_pool import BrowserPool, IPHONE15_PIXEL_RATIO
+from tools.render_executor import RenderExecutor, RenderQueueFull
+from tools.render_cache import RenderCache, cache_key
+from tools.render_workers import RenderWorkerPool, RENDER_WORKERS
+from tools.card_encoder import (CARD_FORMATS, CARD_THUMBNAIL_WIDTHS, CARD_PNG_COMPRESSION, negotiate_format,
+                                ensure_card_variant, remove_card_variants)
+from tools.extract_debug import debug_writer
+from tools.card_extractor import extraction_stats, extraction_settings
 import asyncio
+from contextlib import aclosing
 from dotenv import load_dotenv
 import requests
 # Import functions from llm_prompt.py
-from tools.llm_prompt import call_ark_llm, extract_html_from_response
-from tools.prompt_config import SYSTEM_PROMPT_WEB_DESIGNER, USER_PROMPT_WEB_DESIGNER, SYSTEM_PROMPT_SUMMARIZE_2MD
-from tools.llm_caller import generate_content_with_llm
+from tools.llm_prompt import stream_ark_llm, HtmlStreamCollector, extract_html_from_response
+from tools.prompt_config import SYSTEM_PROMPT_WEB_DESIGNER, USER_PROMPT_WEB_DESIGNER
+from tools.llm_caller import llm_singleflight
+from tools.llm_clients import llm_clients
+from tools.llm_cache import llm_cache, lookup_llm_cache
+from tools.llm_governor import LLMBusy, governor_stats
+from tools.summarizer import summarize_text
+from tools.llm_tokens import PromptTooLarge, token_usage
+from tools.llm_hedge import llm_hedger
 import os
 
 # 配置日志
@@ -41,14 +59,53 @@ logger.info(f"JINA_API_KEY loaded: {'Yes' if JINA_API_KEY else 'No'}")
 
 app = FastAPI()
 
+# 长期存活的 headless Chrome 池，渲染时只需付页面加载和截图的开销
+browser_pool = BrowserPool()
+# 设置 RENDER_WORKERS>0 时改为在独立的 worker 进程中渲染，每个进程持有自己的浏览器
+render_workers = RenderWorkerPool(RENDER_WORKERS) if RENDER_WORKERS > 0 else None
+# 阻塞的渲染和提取放到独立线程池中执行，避免卡住事件循环
+render_executor = RenderExecutor(concurrency=RENDER_WORKERS) if render_workers else RenderExecutor()
+
+@app.on_event("startup")
+async def startup_browser_pool():
+    llm_clients.start()
+    if render_workers is not None:
+        await asyncio.to_thread(render_workers.start)
+    else:
+        await asyncio.to_thread(browser_pool.start)
+
+@app.on_event("shutdown")
+async def shutdown_browser_pool():
+    await asyncio.to_thread(render_executor.shutdown)
+    if render_workers is not None:
+        await asyncio.to_thread(render_workers.close)
+    await asyncio.to_thread(browser_pool.close)
+    await llm_clients.close()
 
 # Constants
 OUTPUT_DIR = "output"
+# 影响卡片输出的渲染参数，同时参与渲染缓存键的计算
+CARD_RENDER_WIDTH = 1200
+CARD_EXTRACT_MIN_AREA = 500  # OpenCV 提取的最小文字块面积(截图像素)
+# 卡片元素的CSS选择器，未设置时自动选取页面中最外层的可见内容块
+CARD_SELECTOR = os.getenv("CARD_SELECTOR") or None
+# 其它会改变缓存的 _card.png 内容的配置(裁剪边距、就绪等待、提取级联、PNG编码)，
+# 同样参与渲染缓存键，修改环境变量后不会继续返回旧的卡片
+RENDER_CACHE_SETTINGS = {
+    "clip_padding": CARD_CLIP_PADDING,
+    "ready_timeout": RENDER_READY_TIMEOUT,
+    "resize_ready_timeout": RENDER_RESIZE_READY_TIMEOUT,
+    "network_idle_ms": RENDER_NETWORK_IDLE_MS,
+    "png_compression": CARD_PNG_COMPRESSION,
+    "extract": extraction_settings(),
+}
 STATIC_DIR = "static"
 TEMPLATES_DIR = "templates"
 
 # Ensure output and static directories exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 按HTML内容和渲染参数寻址的卡片缓存
+render_cache = RenderCache()
 app_static_dir = os.path.join(os.path.dirname(__file__), STATIC_DIR)
 os.makedirs(app_static_dir, exist_ok=True)
 app.mount(f"/{STATIC_DIR}", StaticFiles(directory=app_static_dir), name=STATIC_DIR)
@@ -75,6 +132,7 @@ class GenerationRequest(BaseModel):
     style: Optional[str] = Field(default="default")
     model: Optional[str] = None
     temperature: Optional[float] = 0.7
+    no_cache: bool = False  # 为True时不使用缓存的LLM响应，重新生成
 
 class GenerationResponseData(BaseModel):
     """API的数据响应结构，用于返回生成内容的状态和信息"""
@@ -86,14 +144,27 @@ class GenerationResponseData(BaseModel):
     raw_llm_response: Optional[str] = None
     message: Optional[str] = None
 
+class BatchItem(BaseModel):
+    """批量生成中的一项：提供 html_input 生成新卡片，或提供已有的 file_id 重新渲染"""
+    html_input: Optional[str] = None
+    file_id: Optional[str] = None
+
+class BatchGenerationRequest(BaseModel):
+    items: List[BatchItem]
+    parallelism: Optional[int] = None
+
 class SummarizeRequest(BaseModel):
     content: str
     model: Optional[str] = None
+    no_cache: bool = False  # 为True时不使用缓存的LLM响应，重新生成
 
 class SummarizeResponse(BaseModel):
     summary: str
     success: bool
     message: Optional[str] = None
+    mode: Optional[str] = None          # single: 一次总结；map_reduce: 分段总结后合并
+    chunks: Optional[int] = None        # 分段数
+    timings: Optional[Dict[str, Any]] = None  # 各阶段耗时(毫秒)
 
 class WebFetchRequest(BaseModel):
     url: str
@@ -123,12 +194,77 @@ def generate_html_from_markdown(markdown_content: str, style: str, file_id: str,
     logger.info(f"HTML file generated: {html_path}")
     return html_path
 
-async def generate_card(payload: GenerationRequest) -> GenerationResponseData:
-    """根据提供的请求负载生成卡片。"""
+def render_card_image(html_content: str, card_image_path: str) -> bool:
+    """
+    在内存中渲染HTML并提取卡片，只把最终的卡片图片写入磁盘。
+    启用了渲染 worker 进程时在 worker 中执行，否则使用本进程的浏览器池。
+    返回是否提取成功；渲染失败时抛出异常。
+    """
+    options = dict(width=CARD_RENDER_WIDTH, card_selector=CARD_SELECTOR, min_area=CARD_EXTRACT_MIN_AREA,
+                   element_min_area=CARD_ELEMENT_MIN_AREA)
+    if render_workers is not None:
+        return render_workers.render_card(html_content, card_image_path, **options)
+    return render_card_to_file(html_content, card_image_path, pool=browser_pool, **options)
+
+async def render_card(html_content: str, card_image_path: str) -> bool:
+    """
+    生成卡片图片：先查渲染缓存，未命中时交给渲染执行器，并把结果加入缓存。
+    重新渲染已有卡片时先删除旧的派生版本(WebP、缩略图等)，之后按需重新生成。
+    只缓存提取成功的卡片，提取失败时保存的整页截图不进入缓存，下次重新渲染。
+    返回是否提取成功(命中缓存视为成功)。
+    """
+    await asyncio.to_thread(remove_card_variants, card_image_path)
+    key = cache_key(html_content, width=CARD_RENDER_WIDTH, pixel_ratio=IPHONE15_PIXEL_RATIO,
+                    capture_mode=CAPTURE_ELEMENT, card_selector=CARD_SELECTOR, min_area=CARD_EXTRACT_MIN_AREA,
+                    element_min_area=CARD_ELEMENT_MIN_AREA, settings=RENDER_CACHE_SETTINGS)
+    if await asyncio.to_thread(render_cache.fetch, key, card_image_path):
+        logger.info(f"渲染缓存命中: {key[:12]} -> {card_image_path}")
+        return True
+    extracted = await render_executor.submit(render_card_image, html_content, card_image_path)
+    if extracted:
+        await asyncio.to_thread(render_cache.put, key, card_image_path)
+    return extracted
+
+async def generate_html_with_llm(prompt: str, model: str, temperature: float, on_delta=None, use_cache: bool = True):
+    """
+    流式调用LLM生成HTML，一旦出现完整的HTML文档(</html>)就停止读取并关闭流，
+    不再等待模型在文档之后继续输出的内容。
+    on_delta: 可选的异步回调，每收到一个片段调用一次，用于实时预览；命中缓存时以完整响应调用一次。
+    use_cache: 为False时跳过LLM响应缓存，重新生成(新结果仍会写入缓存)。
+    返回 (截止时的原始响应, HTML内容)。
+    """
+    key, cached = await asyncio.to_thread(lookup_llm_cache, "ark", model, SYSTEM_PROMPT_WEB_DESIGNER, prompt,
+                                          temperature, use_cache)
+    if cached is not None:
+        if on_delta is not None:
+            await on_delta(cached)
+        return cached, extract_html_from_response(cached)
+
+    collector = HtmlStreamCollector()
+    async with aclosing(stream_ark_llm(prompt=prompt, model_id=model, temperature=temperature)) as stream:
+        async for delta in stream:
+            if on_delta is not None:
+                await on_delta(delta)
+            if collector.feed(delta):
+                logger.info(f"已收到完整HTML ({len(collector.html)} 字符)，提前结束LLM流")
+                break
+    raw = collector.text
+    # 只缓存得到了完整HTML文档的响应，截断或无效的输出下次重新生成
+    if key and collector.html is not None:
+        await asyncio.to_thread(llm_cache.put, key, raw)
+    # 流结束仍没有完整文档时按原来的规则从全文中提取
+    return raw, collector.html or extract_html_from_response(raw)
+
+async def generate_card(payload: GenerationRequest, on_event=None) -> GenerationResponseData:
+    """
+    根据提供的请求负载生成卡片。
+    on_event: 可选的异步回调 on_event(事件名, 数据)，流式接口用它推送生成进度。
+    """
     # 生成唯一的文件ID
     file_id = str(uuid.uuid4())
     llm_raw_response = ""
     html_path = ""
+    html_content = ""
     
     # 根据生成模式处理
     if payload.mode == GenerationMode.PROMPT:
@@ -150,27 +286,32 @@ async def generate_card(payload: GenerationRequest) -> GenerationResponseData:
             # 调用LLM生成内容
             logger.info(f"使用模型 '{payload.model or 'default'}' 调用LLM")
             
-            # 使用直接从llm_prompt.py导入的call_ark_llm函数
+            # 使用共享异步客户端流式调用Ark LLM
             model_to_use = payload.model or "deepseek-v3-250324"  # 默认模型
             temperature_to_use = payload.temperature or 0.7       # 默认温度
             
-            # 使用同步调用，放到异步线程中执行
-            llm_raw_response = await asyncio.to_thread(
-                call_ark_llm,
-                prompt=combined_prompt,
-                model_id=model_to_use,
-                temperature=temperature_to_use
-            )
+            async def emit_delta(delta):
+                await on_event("delta", {"text": delta})
+            on_delta = emit_delta if on_event is not None else None
             
-            # 从LLM响应中提取HTML
-            html_content = extract_html_from_response(llm_raw_response)
+            # 收到完整HTML即返回，随后立即开始渲染
+            llm_raw_response, html_content = await generate_html_with_llm(
+                combined_prompt, model_to_use, temperature_to_use, on_delta, use_cache=not payload.no_cache)
             
             # 保存提取的HTML到文件
             html_path = os.path.join(OUTPUT_DIR, f"{file_id}.html")
             with open(html_path, "w", encoding="utf-8") as f:
                 f.write(html_content)
             logger.info(f"HTML内容已保存到: {html_path}")
+            if on_event is not None:
+                await on_event("html", {"file_id": file_id, "html": html_content})
             
+        except LLMBusy as e:
+            logger.warning(f"LLM服务繁忙，拒绝请求: {file_id}: {e}")
+            raise HTTPException(status_code=503, detail=f"LLM服务繁忙，请稍后重试: {e}")
+        except PromptTooLarge as e:
+            logger.warning(f"提示词超出token预算，拒绝请求: {file_id}: {e}")
+            raise HTTPException(status_code=413, detail=f"提示词过长: {e}")
         except Exception as e:
             logger.error(f"通过LLM生成内容时发生错误: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"LLM调用期间发生内部服务器错误: {str(e)}")
@@ -180,36 +321,27 @@ async def generate_card(payload: GenerationRequest) -> GenerationResponseData:
         if not payload.html_input:
             raise HTTPException(status_code=400, detail="PASTE模式需要提供HTML输入")
         logger.info(f"处理PASTE模式 - file_id: {file_id}")
+        html_content = payload.html_input
         html_path = os.path.join(OUTPUT_DIR, f"{file_id}.html")
         with open(html_path, "w", encoding="utf-8") as f:
-            f.write(payload.html_input)
+            f.write(html_content)
         logger.info(f"HTML文件已直接保存: {html_path}")
     else:
         # 无效的生成模式
         raise HTTPException(status_code=400, detail="无效的生成模式")
 
-    # 直接从HTML生成图像
-    image_path = os.path.join(OUTPUT_DIR, f"{file_id}.png")
+    # 在内存中从HTML渲染并提取卡片，只有最终的卡片图片会写入磁盘
     card_image_path = os.path.join(OUTPUT_DIR, f"{file_id}_card.png")
-    
-    # 使用Selenium从HTML生成图像
-    logger.info(f"使用Selenium从HTML生成图像: {html_path} -> {image_path}")
-    image_success = html_to_image(html_path, image_path, width=1200)
-    
-    if not image_success:
-        logger.error(f"从HTML生成图像失败: {html_path}")
+    logger.info(f"使用Selenium从HTML生成卡片: {file_id} -> {card_image_path}")
+    try:
+        await render_card(html_content, card_image_path)
+    except RenderQueueFull as e:
+        logger.warning(f"渲染队列已满，拒绝请求: {file_id}")
+        raise HTTPException(status_code=503, detail=f"渲染服务繁忙，请稍后重试: {e}")
+    except Exception as e:
+        logger.error(f"从HTML生成图像失败: {file_id}: {e}")
         raise HTTPException(status_code=500, detail="生成图像失败")
     
-    # 从生成的图像提取卡片
-    logger.info(f"从图像提取卡片: {image_path} -> {card_image_path}")
-    card_success = extract_card_from_image(image_path, card_image_path, min_area=500, debug=True)
-    
-    if not card_success:
-        logger.warning(f"卡片提取失败，使用原始图像作为备选: {image_path} -> {card_image_path}")
-        # 如果提取失败，使用原始图像作为备用
-        import shutil
-        shutil.copy(image_path, card_image_path)
-    
     # 构造API URL
     html_url = f"/api/download-html/{file_id}"
     image_url = f"/api/download-image/{file_id}"
@@ -233,6 +365,124 @@ async def generate_files(payload: GenerationRequest):
     response_data = await generate_card(payload)
     return response_data
 
+@app.post("/api/generate-stream")
+async def generate_files_stream(payload: GenerationRequest):
+    """
+    与 /api/generate 相同，但以 Server-Sent Events 推送进度：
+    delta(LLM输出片段，用于实时预览) -> html(完整HTML，开始渲染) -> done(与 /api/generate 相同的结果)，
+    出错时推送 error。客户端断开时取消生成。
+    """
+    events = asyncio.Queue()
+
+    async def emit(event, data):
+        await events.put((event, data))
+
+    async def run():
+        try:
+            result = await generate_card(payload, emit)
+            await emit("done", jsonable_encoder(result))
+        except HTTPException as e:
+            await emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"流式生成失败: {e}", exc_info=True)
+            await emit("error", {"status_code": 500, "detail": str(e)})
+        finally:
+            await events.put(None)
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while (item := await events.get()) is not None:
+                event, data = item
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def parse_file_id(file_id: str) -> str:
+    """file_id 必须是UUID(返回规范写法)，防止拼接路径时访问 OUTPUT_DIR 之外的文件"""
+    try:
+        return str(uuid.UUID(file_id))
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail=f"无效的file_id: {file_id}")
+
+async def generate_batch_item(index: int, item: BatchItem) -> dict:
+    """渲染批量请求中的一项，返回该项的结果，不抛出异常"""
+    started = time.monotonic()
+    file_id = item.file_id or str(uuid.uuid4())
+    result = {"index": index, "file_id": file_id, "success": False}
+    try:
+        html_path = os.path.join(OUTPUT_DIR, f"{file_id}.html")
+        if item.html_input:
+            html_content = item.html_input
+            with open(html_path, "w", encoding="utf-8") as f:
+                f.write(html_content)
+        elif item.file_id and os.path.exists(html_path):
+            with open(html_path, "r", encoding="utf-8") as f:
+                html_content = f.read()
+        else:
+            raise ValueError("需要提供html_input或已存在的file_id")
+
+        card_image_path = os.path.join(OUTPUT_DIR, f"{file_id}_card.png")
+        result["extracted"] = await render_card(html_content, card_image_path)
+        result["success"] = True
+        result["html_path"] = f"/api/download-html/{file_id}"
+        result["image_path"] = f"/api/download-image/{file_id}"
+    except Exception as e:
+        logger.error(f"批量生成第{index}项失败: {e}")
+        result["message"] = str(e)
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+@app.post("/api/generate-batch")
+async def generate_batch(payload: BatchGenerationRequest):
+    """
+    批量渲染多个HTML文档或已有的file_id。
+
+    多个浏览器实例并行渲染，提取在渲染线程中并发执行；每完成一项就以一行JSON(NDJSON)
+    返回其结果，最后一行为吞吐量汇总(cards_per_second)。
+    """
+    if not payload.items:
+        raise HTTPException(status_code=400, detail="批量请求需要至少一项")
+    for item in payload.items:
+        if item.file_id is not None:
+            item.file_id = parse_file_id(item.file_id)
+    # 并行度不超过渲染执行器的并发数，避免批量请求占满有界队列
+    parallelism = min(payload.parallelism or render_executor.concurrency, render_executor.concurrency)
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+
+    async def run(index, item):
+        async with semaphore:
+            return await generate_batch_item(index, item)
+
+    async def stream():
+        started = time.monotonic()
+        succeeded = 0
+        tasks = [asyncio.create_task(run(i, item)) for i, item in enumerate(payload.items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                succeeded += result["success"]
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+        elapsed = time.monotonic() - started
+        yield json.dumps({
+            "done": True,
+            "total": len(tasks),
+            "succeeded": succeeded,
+            "failed": len(tasks) - succeeded,
+            "parallelism": parallelism,
+            "elapsed_s": round(elapsed, 3),
+            "cards_per_second": round(len(tasks) / elapsed, 3) if elapsed > 0 else None,
+        }) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.get("/")
 async def read_root(request: Request):
     """Serves the main HTML page."""
@@ -241,15 +491,28 @@ async def read_root(request: Request):
 @app.get("/api/download-html/{file_id}")
 async def download_html(file_id: str):
     """Serves the generated HTML file."""
+    file_id = parse_file_id(file_id)
     file_path = os.path.join(OUTPUT_DIR, f"{file_id}.html")
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="HTML file not found")
     return FileResponse(file_path, media_type='text/html', filename=f"{file_id}.html")
 
 @app.get("/api/download-image/{file_id}")
-async def download_image(file_id: str):
-    """Serves the generated card image file."""
-    image_path = os.path.join(OUTPUT_DIR, f"{file_id}.png")
+async def download_image(file_id: str, request: Request, format: Optional[str] = None, width: Optional[int] = None):
+    """
+    Serves the generated card image file.
+
+    The format (png/webp/jpeg) is taken from the `format` query parameter, or negotiated
+    from the Accept header, defaulting to PNG. `width` selects one of the configured
+    thumbnail widths. Variants that were not encoded up front are created on first request.
+    """
+    file_id = parse_file_id(file_id)
+    fmt = negotiate_format(format, request.headers.get("accept"))
+    if fmt is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported image format: {format}")
+    if width is not None and width not in CARD_THUMBNAIL_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"Unsupported thumbnail width: {width}")
+
     card_image_path = os.path.join(OUTPUT_DIR, f"{file_id}_card.png")
     
     if not os.path.exists(card_image_path):
@@ -258,32 +521,62 @@ async def download_image(file_id: str):
         
         if not os.path.exists(html_path):
             raise HTTPException(status_code=404, detail="HTML file not found, cannot regenerate image")
+        with open(html_path, "r", encoding="utf-8") as f:
+            html_content = f.read()
         
-        # Generate image directly from HTML using Selenium
-        logger.info(f"Generating image from HTML {html_path} using Selenium")
-        if not html_to_image(html_path, image_path, width=1200):
+        # Render the HTML in memory and extract the card using Selenium
+        logger.info(f"Regenerating card image from HTML {html_path} using Selenium")
+        try:
+            await render_card(html_content, card_image_path)
+        except RenderQueueFull as e:
+            raise HTTPException(status_code=503, detail=f"Render queue is full, try again later: {e}")
+        except Exception as e:
+            logger.error(f"Failed to generate image from HTML {html_path}: {e}")
             raise HTTPException(status_code=500, detail="Failed to generate image from HTML")
-        
-        # Extract card from the generated image
-        logger.info(f"Extracting card from {image_path} to {card_image_path}")
-        if not extract_card_from_image(image_path, card_image_path, min_area=500, debug=True):
-            logger.warning("Card extraction failed, using the full image instead")
-            # If extraction fails, use the original image as fallback
-            if os.path.exists(image_path):
-                import shutil
-                shutil.copy(image_path, card_image_path)
-            else:
-                raise HTTPException(status_code=500, detail="Failed to generate card image")
     
     if not os.path.exists(card_image_path):
         raise HTTPException(status_code=404, detail="Card image file not found")
-    
-    return FileResponse(card_image_path, media_type='image/png', filename=f"{file_id}_card.png")
+
+    if fmt == "png" and width is None:
+        variant = card_image_path
+    else:
+        variant = await asyncio.to_thread(ensure_card_variant, card_image_path, fmt, width)
+    media_type = CARD_FORMATS[fmt][0]
+    return FileResponse(variant, media_type=media_type, filename=os.path.basename(variant),
+                        headers={"Vary": "Accept"})
+
+@app.get("/api/render-stats")
+async def render_stats():
+    """Reports render queue depth, wait times and browser pool usage."""
+    return {
+        "executor": render_executor.stats(),
+        "browser_pool": browser_pool.stats(),
+        "workers": render_workers.stats() if render_workers is not None else None,
+        "cache": render_cache.stats(),
+        # 启用渲染 worker 进程时调试图片在各 worker 中写入，这里只统计本进程
+        "extract_debug": debug_writer.stats(),
+        "extract_cascade": extraction_stats(),
+    }
+
+@app.get("/api/llm-stats")
+async def llm_stats():
+    """
+    Reports LLM response cache hits and misses, request coalescing, per-model governor limits,
+    token usage and hedging (with per-provider latency histograms).
+    """
+    return {
+        "cache": llm_cache.stats(),
+        "coalescing": llm_singleflight.stats(),
+        "governors": governor_stats(),
+        "tokens": token_usage.stats(),
+        "hedging": llm_hedger.stats(),
+    }
 
 @app.post("/api/summarize", response_model=SummarizeResponse)
 async def summarize_content(summarize_req: SummarizeRequest):
     """
-    接收用户内容并生成智能总结
+    接收用户内容并生成智能总结。
+    长文按 Markdown 标题分段、并行提取要点后再合并总结，返回分段数和各阶段耗时。
     """
     try:
         content = summarize_req.content
@@ -295,25 +588,20 @@ async def summarize_content(summarize_req: SummarizeRequest):
                 message="请提供需要总结的内容"
             )
 
-        # 构造总结提示词
-        summarize_prompt = f"""请对以下内容进行简洁明了的总结，突出关键信息，保持语言简练：
-
-{content}
-
-总结：
-"""
-
-        # 调用LLM生成总结
-        summary = await generate_content_with_llm(
-            prompt=summarize_prompt,
-            sys_prompt=SYSTEM_PROMPT_SUMMARIZE_2MD,
+        # 按长度自动选择一次总结或分段(map-reduce)总结
+        result = await summarize_text(
+            content,
             model=summarize_req.model,
-            temperature=0.5  # 使用较低的温度以获得更一致的总结
+            use_cache=not summarize_req.no_cache,
         )
+        logger.info(f"总结完成: {result['mode']}，{result['chunks']} 段，耗时 {result['timings']['total_ms']}ms")
 
         return SummarizeResponse(
-            summary=summary.strip(),
-            success=True
+            summary=result["summary"],
+            success=True,
+            mode=result["mode"],
+            chunks=result["chunks"],
+            timings=result["timings"],
         )
     except Exception as e:
         logger.error(f"内容总结失败: {str(e)}")
@@ -0,0 +1,40 @@
+import numpy as np
+
+from tools import card_extractor
+from tools.card_extractor import CascadeStats, extract_card
+
+
+def _stages(result):
+    return {stage["stage"]: stage for stage in result.stages}
+
+
+def test_slow_stage_is_retried_after_skips(monkeypatch):
+    monkeypatch.setattr(card_extractor, "cascade_stats", CascadeStats(skip_decay=0.5))
+    # 纯色背景上只有一个像素：投影能找到区域但不可信，之后的级别可以按历史耗时跳过
+    img = np.full((400, 300, 3), 255, np.uint8)
+    img[200, 150] = 0
+    megapixels = 400 * 300 / 1_000_000
+    card_extractor.cascade_stats.record("morphology", 10_000.0, False, megapixels)
+
+    budgets = {"morphology": 400}
+    first = extract_card(img, debug=False, stage_budgets=budgets)
+    assert _stages(first)["morphology"].get("reason") == "stage_budget"
+
+    for _ in range(10):
+        result = extract_card(img, debug=False, stage_budgets=budgets)
+        if "ms" in _stages(result)["morphology"]:
+            break
+    else:
+        raise AssertionError("morphology was never retried after a single slow run")
+
+
+def test_no_skip_before_any_stage_found_a_box(monkeypatch):
+    monkeypatch.setattr(card_extractor, "cascade_stats", CascadeStats())
+    # 噪点背景：投影快速路径不返回任何区域
+    img = np.random.default_rng(0).integers(0, 255, (400, 300, 3), dtype=np.uint8)
+    megapixels = 400 * 300 / 1_000_000
+    card_extractor.cascade_stats.record("morphology", 10_000.0, False, megapixels)
+
+    result = extract_card(img, debug=False, stage_budgets={"morphology": 400})
+    assert _stages(result)["projection"]["hit"] is False
+    assert "ms" in _stages(result)["morphology"]
@@ -0,0 +1,128 @@
+"""
+卡片提取快速路径基准测试
+
+对比背景投影快速路径、金字塔(由粗到细)检测与全分辨率形态学方法的耗时，
+并检查它们得到的裁剪区域是否一致。
+默认使用 tools/output_images 下的PNG，也可以传入其它图片路径。
+
+用法：
+    python -m tools.bench_card_extractor [图片 ...] [--repeat 5] [--min-iou 0.98]
+"""
+import os
+import glob
+import time
+import argparse
+
+import cv2
+
+from .card_extractor import (find_card_box_projection, find_card_box_morphology, find_card_box_pyramid,
+                             pad_card_box)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "output_images")
+
+
+def box_iou(a, b):
+    """两个 (x_start, y_start, x_end, y_end) 区域的交并比"""
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+def time_call(fn, repeat):
+    """返回 (最后一次的结果, 最短耗时毫秒)"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def bench_image(path, repeat=5, min_area=500):
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    height, width = img.shape[:2]
+
+    def morphology():
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return find_card_box_morphology(img, gray, min_area)
+
+    morph_box, morph_ms = time_call(morphology, repeat)
+    proj_box, proj_ms = time_call(lambda: find_card_box_projection(img), repeat)
+    pyr_box, pyr_ms = time_call(lambda: find_card_box_pyramid(img, min_area), repeat)
+
+    result = {
+        "image": os.path.basename(path),
+        "size": f"{width}x{height}",
+        "morphology_ms": morph_ms,
+        "projection_ms": proj_ms,
+        "pyramid_ms": pyr_ms,
+        "fast_path": proj_box is not None,
+        "iou": None,
+        "max_edge_px": None,
+        "pyramid_iou": None,
+    }
+    if morph_box is not None:
+        a = pad_card_box(morph_box, width, height)
+        if proj_box is not None:
+            b = pad_card_box(proj_box, width, height)
+            result["iou"] = box_iou(a, b)
+            result["max_edge_px"] = max(abs(p - q) for p, q in zip(a, b))
+        if pyr_box is not None:
+            result["pyramid_iou"] = box_iou(a, pad_card_box(pyr_box, width, height))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="卡片提取快速路径基准测试")
+    parser.add_argument("images", nargs="*", help="图片路径，默认使用 tools/output_images/*.png")
+    parser.add_argument("--repeat", type=int, default=5, help="每种方法重复次数，取最短耗时")
+    parser.add_argument("--min-iou", type=float, default=0.98, help="两种方法裁剪区域视为一致的最小交并比")
+    args = parser.parse_args()
+
+    images = args.images or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.png")))
+    print(f"{'图片':<32}{'尺寸':>12}{'形态学ms':>10}{'投影ms':>9}{'加速':>8}{'IoU':>8}{'边差px':>8}"
+          f"{'金字塔ms':>10}{'IoU':>8}  结果")
+
+    total_morph = total_proj = total_pyr = 0.0
+    mismatches = 0
+    for path in images:
+        r = bench_image(path, args.repeat)
+        if r is None:
+            print(f"{os.path.basename(path):<32} 无法读取")
+            continue
+        if not r["fast_path"]:
+            status = "退回形态学"
+            proj_total = r["projection_ms"] + r["morphology_ms"]
+        elif r["iou"] is None:
+            status = "仅快速路径有结果"
+            proj_total = r["projection_ms"]
+        else:
+            status = "一致" if r["iou"] >= args.min_iou else "不一致"
+            mismatches += status == "不一致"
+            proj_total = r["projection_ms"]
+        if r["pyramid_iou"] is not None and r["pyramid_iou"] < args.min_iou:
+            status += "，金字塔不一致"
+            mismatches += 1
+        total_morph += r["morphology_ms"]
+        total_proj += proj_total
+        total_pyr += r["pyramid_ms"]
+        iou = f"{r['iou']:.4f}" if r["iou"] is not None else "-"
+        edge = str(r["max_edge_px"]) if r["max_edge_px"] is not None else "-"
+        pyr_iou = f"{r['pyramid_iou']:.4f}" if r["pyramid_iou"] is not None else "-"
+        print(f"{r['image']:<32}{r['size']:>12}{r['morphology_ms']:>10.1f}{r['projection_ms']:>9.1f}"
+              f"{r['morphology_ms'] / proj_total:>7.1f}x{iou:>8}{edge:>8}{r['pyramid_ms']:>10.1f}{pyr_iou:>8}  {status}")
+
+    if total_proj:
+        print(f"\n合计: 形态学 {total_morph:.1f}ms, 快速路径(含回退) {total_proj:.1f}ms, "
+              f"加速 {total_morph / total_proj:.1f}x; 金字塔 {total_pyr:.1f}ms, 加速 {total_morph / total_pyr:.1f}x; "
+              f"不一致 {mismatches} 处")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,228 @@
+"""
+卡片提取基准测试套件
+
+对合成卡片(尺寸、宽高比、背景噪声、内容块数可控)和 tools/output_images 下的截图
+运行 extract_card，记录每组参数的耗时、峰值内存(RSS)和裁剪准确率(与真实区域的IoU)，
+结果输出为JSON，可以与上一次的结果对比，发现性能或准确率回退。
+
+每组参数在独立的子进程中运行，峰值RSS互不影响。子进程和线上渲染路径一样从PNG字节开始，
+测量的耗时和内存包含解码。合成卡片以卡片矩形为真实区域；截图没有标注时以全分辨率
+形态学方法的结果为参考区域。
+
+用法：
+    python -m tools.bench_extract_suite [-o result.json] [--baseline 上次结果.json] [--repeat 3]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import itertools
+import statistics
+import multiprocessing
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "output_images")
+
+# 默认参数网格：截图宽度(1179 = 393 CSS像素 x 3倍像素比)、卡片高宽比、背景噪声、内容块数
+DEFAULT_WIDTHS = [1179, 2480]
+DEFAULT_ASPECTS = [1.4, 2.2]
+DEFAULT_NOISE = [0, 6]
+DEFAULT_BLOCKS = [4, 16]
+
+
+def _proc_status_mb(field):
+    """读取 /proc/self/status 中的内存字段(MB)，不可用时返回None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Linux 上把峰值RSS重置为当前RSS，使峰值只反映之后的提取过程"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    """本进程的峰值常驻内存(MB)"""
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    # ru_maxrss 会继承自父进程，只在没有 /proc 时使用；Linux 上单位为KB，macOS 上为字节
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def prepare_case(case):
+    """在父进程中准备输入：返回 (PNG字节, 真实区域 (x, y, w, h) 或None, 参考类型)"""
+    import cv2
+    from .card_extractor import find_card_box_morphology
+    from .synthetic_cards import generate_card
+
+    if case["kind"] == "synthetic":
+        img, truth = generate_card(**case["params"])
+        reference = "ground_truth"
+    else:
+        img = cv2.imread(case["path"])
+        if img is None:
+            raise FileNotFoundError(case["path"])
+        truth = find_card_box_morphology(img, cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+        reference = "morphology"
+    ok, buf = cv2.imencode(".png", img)
+    return buf.tobytes(), truth, reference
+
+
+def _run_case(png, truth, reference, repeat, conn):
+    """子进程入口：重复运行提取，回传测量结果"""
+    try:
+        from .card_extractor import extract_card, pad_card_box
+        from .bench_card_extractor import box_iou
+
+        _reset_peak_rss()
+        rss_before = _proc_status_mb("VmRSS") or _peak_rss_mb()
+        times = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = extract_card(png, debug=False)
+            times.append((time.perf_counter() - start) * 1000)
+        width, height = result.image_size
+
+        iou = None
+        if result and truth is not None:
+            iou = round(box_iou(result.box, pad_card_box(truth, width, height)), 4)
+        conn.send({
+            "size": f"{width}x{height}",
+            "ok": bool(result),
+            "method": result.method,
+            "wall_ms_min": round(min(times), 2),
+            "wall_ms_median": round(statistics.median(times), 2),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "rss_growth_mb": round(_peak_rss_mb() - rss_before, 1),
+            "iou": iou,
+            "reference": reference,
+        })
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def build_cases(widths=DEFAULT_WIDTHS, aspects=DEFAULT_ASPECTS, noise=DEFAULT_NOISE, blocks=DEFAULT_BLOCKS,
+                fixtures=True, seed=0):
+    cases = []
+    for w, a, n, b in itertools.product(widths, aspects, noise, blocks):
+        cases.append({
+            "name": f"synthetic_w{w}_a{a}_n{n}_b{b}",
+            "kind": "synthetic",
+            "params": {"width": w, "aspect": a, "noise": n, "blocks": b, "seed": seed},
+        })
+    if fixtures:
+        for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.png"))):
+            cases.append({"name": f"fixture_{os.path.basename(path)}", "kind": "fixture", "path": path})
+    return cases
+
+
+def run_suite(cases, repeat=3, timeout=300):
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for case in cases:
+        try:
+            png, truth, reference = prepare_case(case)
+        except Exception as e:
+            results[case["name"]] = {**{k: v for k, v in case.items() if k != "name"}, "error": str(e)}
+            continue
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=_run_case, args=(png, truth, reference, repeat, child_conn))
+        process.start()
+        child_conn.close()
+        if parent_conn.poll(timeout):
+            measured = parent_conn.recv()
+        else:
+            measured = {"error": f"超时 ({timeout}s)"}
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+        results[case["name"]] = {**{k: v for k, v in case.items() if k != "name"}, **measured}
+        line = measured.get("error") or (f"{measured['wall_ms_median']:>9.1f}ms {measured['peak_rss_mb']:>7.1f}MB "
+                                         f"IoU {measured['iou']} ({measured['method']})")
+        print(f"{case['name']:<44} {line}", file=sys.stderr)
+    return results
+
+
+def compare(current, baseline, time_tolerance=0.2, iou_tolerance=0.02):
+    """
+    与上一次的结果对比，返回回退列表。
+    耗时(中位数)增加超过 time_tolerance 比例、IoU 下降超过 iou_tolerance、
+    或原来成功的用例失败时视为回退。
+    """
+    regressions = []
+    for name, base in baseline.get("cases", {}).items():
+        cur = current["cases"].get(name)
+        if cur is None or "error" in base:
+            continue
+        if "error" in cur:
+            regressions.append(f"{name}: 运行出错 {cur['error']}")
+            continue
+        if base.get("ok") and not cur.get("ok"):
+            regressions.append(f"{name}: 原来能提取，现在失败")
+        if cur["wall_ms_median"] > base["wall_ms_median"] * (1 + time_tolerance):
+            regressions.append(f"{name}: 耗时 {base['wall_ms_median']}ms -> {cur['wall_ms_median']}ms")
+        if base.get("iou") is not None and (cur.get("iou") or 0) < base["iou"] - iou_tolerance:
+            regressions.append(f"{name}: IoU {base['iou']} -> {cur.get('iou')}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="卡片提取基准测试套件")
+    parser.add_argument("-o", "--output", help="结果JSON路径，默认输出到标准输出")
+    parser.add_argument("--baseline", help="上一次的结果JSON，提供时对比并在回退时返回非零")
+    parser.add_argument("--repeat", type=int, default=3, help="每组参数重复次数")
+    parser.add_argument("--widths", type=int, nargs="+", default=DEFAULT_WIDTHS)
+    parser.add_argument("--aspects", type=float, nargs="+", default=DEFAULT_ASPECTS)
+    parser.add_argument("--noise", type=float, nargs="+", default=DEFAULT_NOISE)
+    parser.add_argument("--blocks", type=int, nargs="+", default=DEFAULT_BLOCKS)
+    parser.add_argument("--no-fixtures", action="store_true", help="只运行合成卡片")
+    parser.add_argument("--time-tolerance", type=float, default=0.2, help="耗时允许增加的比例")
+    parser.add_argument("--iou-tolerance", type=float, default=0.02, help="IoU允许下降的幅度")
+    args = parser.parse_args()
+
+    cases = build_cases(args.widths, args.aspects, args.noise, args.blocks, fixtures=not args.no_fixtures)
+    current = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "cases": run_suite(cases, args.repeat),
+    }
+    text = json.dumps(current, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.time_tolerance, args.iou_tolerance)
+        for item in regressions:
+            print(f"回退: {item}", file=sys.stderr)
+        print(f"与 {args.baseline} 对比: {len(regressions)} 处回退", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
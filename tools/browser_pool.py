@@ -0,0 +1,231 @@
+"""
+Chrome WebDriver 复用池
+
+启动一个 headless Chrome 往往比加载页面和截图本身还慢，所以这里维护一组长期存活的
+浏览器实例，渲染时借出(checkout)、用完归还(checkin)，只付页面加载和截图的开销。
+
+每个实例在借出时做健康检查，并在达到最大使用次数或最大存活时间后自动回收重建。
+"""
+import os
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+
+logger = logging.getLogger(__name__)
+
+# iPhone 15 设备参数
+IPHONE15_WIDTH = 393
+IPHONE15_HEIGHT = 852
+IPHONE15_PIXEL_RATIO = 3.0  # iPhone 15 has a 3x pixel ratio
+IPHONE15_USER_AGENT = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
+
+# 池配置，可通过环境变量覆盖
+RENDER_POOL_SIZE = int(os.getenv("RENDER_POOL_SIZE", "2"))
+RENDER_POOL_MAX_USES = int(os.getenv("RENDER_POOL_MAX_USES", "200"))
+RENDER_POOL_MAX_AGE = float(os.getenv("RENDER_POOL_MAX_AGE", "1800"))  # 秒
+RENDER_POOL_CHECKOUT_TIMEOUT = float(os.getenv("RENDER_POOL_CHECKOUT_TIMEOUT", "60"))
+
+
+def build_chrome_options(width=IPHONE15_WIDTH, height=None):
+    """构造模拟 iPhone 15 的 headless Chrome 启动参数"""
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")  # Run in headless mode
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--hide-scrollbars")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--force-device-scale-factor=2")  # Keep high DPI
+
+    # Define mobile emulation settings for iPhone 15
+    mobile_emulation = {
+        "deviceMetrics": {
+            "width": width,
+            "height": height or IPHONE15_HEIGHT,
+            "pixelRatio": IPHONE15_PIXEL_RATIO,
+        },
+        "userAgent": IPHONE15_USER_AGENT,
+    }
+    chrome_options.add_experimental_option("mobileEmulation", mobile_emulation)
+    return chrome_options
+
+
+def create_driver(width=IPHONE15_WIDTH, height=None):
+    """启动一个新的 Chrome 实例"""
+    return webdriver.Chrome(options=build_chrome_options(width, height))
+
+
+def set_device_metrics(driver, width, height):
+    """
+    运行时修改视口尺寸，保持 iPhone 15 的移动端模拟和像素比。
+
+    mobileEmulation 只在启动时生效，借助 CDP 可以在同一个浏览器里随时调整，
+    不必为了换一个尺寸重新启动 Chrome。
+    """
+    driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", {
+        "width": int(width),
+        "height": int(height),
+        "deviceScaleFactor": IPHONE15_PIXEL_RATIO,
+        "mobile": True,
+    })
+
+
+class PooledDriver:
+    """池中的一个浏览器实例及其使用统计"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.created_at = time.monotonic()
+        self.uses = 0
+
+    def expired(self, max_uses, max_age):
+        if max_uses and self.uses >= max_uses:
+            return True
+        if max_age and time.monotonic() - self.created_at >= max_age:
+            return True
+        return False
+
+    def healthy(self):
+        try:
+            return self.driver.execute_script("return 1;") == 1
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.warning(f"关闭浏览器实例失败: {e}")
+
+
+class BrowserPool:
+    """
+    线程安全的 Chrome 实例池。
+
+    参数:
+        size: 池中最多同时存在的浏览器数量
+        max_uses: 单个实例最多渲染次数，达到后回收重建
+        max_age: 单个实例最长存活时间(秒)，达到后回收重建
+        checkout_timeout: 借出时等待空闲实例的最长时间(秒)
+        driver_factory: 创建浏览器的函数，默认为 create_driver
+    """
+
+    def __init__(self, size=RENDER_POOL_SIZE, max_uses=RENDER_POOL_MAX_USES,
+                 max_age=RENDER_POOL_MAX_AGE, checkout_timeout=RENDER_POOL_CHECKOUT_TIMEOUT,
+                 driver_factory=create_driver):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.checkout_timeout = checkout_timeout
+        self.driver_factory = driver_factory
+        # LIFO：优先复用刚归还的实例，保持其缓存和进程处于热状态
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self._recycled = 0
+
+    def start(self):
+        """预热：启动全部浏览器实例。启动失败时只记录日志，后续按需创建。"""
+        for _ in range(self.size):
+            with self._lock:
+                if self._closed or self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                self._idle.put(PooledDriver(self.driver_factory()))
+            except Exception as e:
+                with self._lock:
+                    self._created -= 1
+                logger.error(f"预热浏览器实例失败: {e}")
+                return
+        logger.info(f"浏览器池已预热 {self.size} 个实例")
+
+    def _new(self):
+        try:
+            return PooledDriver(self.driver_factory())
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, item):
+        item.quit()
+        with self._lock:
+            self._created -= 1
+            self._recycled += 1
+
+    def checkout(self, timeout=None):
+        """借出一个健康的浏览器实例，必要时新建或等待其他请求归还"""
+        if self._closed:
+            raise RuntimeError("浏览器池已关闭")
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            try:
+                item = self._idle.get_nowait()
+            except queue.Empty:
+                item = None
+
+            if item is None:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    return self._new()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"等待空闲浏览器超时 ({timeout}s)")
+                try:
+                    item = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    raise TimeoutError(f"等待空闲浏览器超时 ({timeout}s)")
+
+            if item.expired(self.max_uses, self.max_age) or not item.healthy():
+                logger.info(f"回收浏览器实例 (已使用 {item.uses} 次)")
+                self._discard(item)
+                continue
+            return item
+
+    def checkin(self, item, discard=False):
+        """归还浏览器实例；渲染出错或达到回收条件时直接销毁"""
+        item.uses += 1
+        if discard or self._closed or item.expired(self.max_uses, self.max_age):
+            self._discard(item)
+        else:
+            self._idle.put(item)
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """借出浏览器的上下文管理器，块内抛出异常时该实例不会被放回池中"""
+        item = self.checkout(timeout)
+        ok = False
+        try:
+            yield item.driver
+            ok = True
+        finally:
+            self.checkin(item, discard=not ok)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+            "recycled": self._recycled,
+        }
+
+    def close(self):
+        """关闭池并退出所有空闲实例；借出中的实例会在归还时退出"""
+        self._closed = True
+        while True:
+            try:
+                item = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(item)
@@ -0,0 +1,178 @@
+"""
+卡片图片的多格式、多尺寸编码
+
+像素比为3时卡片PNG往往有数MB，PNG编码本身也占不少CPU。这里从同一份解码后的
+图像一次性编码出需要的格式(无损PNG、可调质量的WebP/JPEG)和缩略图宽度，
+下载接口再按查询参数或 Accept 头选择合适的版本。
+"""
+import os
+import glob
+import logging
+import threading
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# 格式 -> (MIME类型, 文件扩展名)
+CARD_FORMATS = {
+    "png": ("image/png", ".png"),
+    "webp": ("image/webp", ".webp"),
+    "jpeg": ("image/jpeg", ".jpg"),
+}
+
+CARD_WEBP_QUALITY = int(os.getenv("CARD_WEBP_QUALITY", "85"))
+CARD_JPEG_QUALITY = int(os.getenv("CARD_JPEG_QUALITY", "85"))
+CARD_PNG_COMPRESSION = int(os.getenv("CARD_PNG_COMPRESSION", "3"))
+
+
+def _parse_list(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+# 生成卡片时预先编码的格式与缩略图宽度，其余版本在首次下载时按需生成
+CARD_EAGER_FORMATS = [f for f in _parse_list(os.getenv("CARD_EAGER_FORMATS", "png,webp")) if f in CARD_FORMATS]
+CARD_THUMBNAIL_WIDTHS = [int(w) for w in _parse_list(os.getenv("CARD_THUMBNAIL_WIDTHS", "393"))]
+CARD_THUMBNAIL_FORMAT = os.getenv("CARD_THUMBNAIL_FORMAT", "webp")
+
+
+def normalize_format(fmt):
+    """把 jpg/JPEG/image/webp 等写法统一为 CARD_FORMATS 中的键，不支持时返回None"""
+    if not fmt:
+        return None
+    fmt = fmt.strip().lower()
+    if fmt.startswith("image/"):
+        fmt = fmt[len("image/"):]
+    if fmt == "jpg":
+        fmt = "jpeg"
+    return fmt if fmt in CARD_FORMATS else None
+
+
+def negotiate_format(requested=None, accept=None, default="png"):
+    """
+    选择返回的图片格式：显式指定的格式优先，其次按 Accept 头中列出的顺序，最后使用默认格式。
+    浏览器直接打开下载链接时 Accept 以 text/html 为主，此时保持默认格式，不因其中的 image/webp 而改变。
+    显式指定了不支持的格式时返回None。
+    """
+    if requested:
+        return normalize_format(requested)
+    if accept and "text/html" not in accept:
+        for part in accept.split(","):
+            fmt = normalize_format(part.split(";")[0])
+            if fmt:
+                return fmt
+    return default
+
+
+def variant_path(card_path, fmt="png", width=None):
+    """卡片某个版本的文件路径，如 xxx_card.png -> xxx_card_w393.webp"""
+    base, _ = os.path.splitext(card_path)
+    suffix = f"_w{width}" if width else ""
+    return f"{base}{suffix}{CARD_FORMATS[fmt][1]}"
+
+
+def remove_card_variants(card_path):
+    """
+    删除卡片的所有派生版本(其它格式和缩略图)，保留主文件 _card.png。
+    重新渲染同一个卡片前调用，避免下载接口继续返回旧卡片的版本。
+    """
+    base, _ = os.path.splitext(card_path)
+    paths = set()
+    for _, ext in CARD_FORMATS.values():
+        paths.add(base + ext)
+        paths.update(glob.glob(glob.escape(base) + "_w*" + ext))
+    paths.discard(card_path)
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def encode_image(img, fmt):
+    """把BGR图像编码为指定格式的字节"""
+    if fmt == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, CARD_PNG_COMPRESSION]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, CARD_WEBP_QUALITY]
+    elif fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, CARD_JPEG_QUALITY]
+    else:
+        raise ValueError(f"不支持的图片格式: {fmt}")
+    ok, buf = cv2.imencode(CARD_FORMATS[fmt][1], img, params)
+    if not ok:
+        raise RuntimeError(f"图片编码失败: {fmt}")
+    return buf.tobytes()
+
+
+def resize_to_width(img, width):
+    """等比缩放到指定宽度，原图不够宽时原样返回"""
+    h, w = img.shape[:2]
+    if width >= w:
+        return img
+    return cv2.resize(img, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+
+
+def save_card_variants(card_path, img, formats=None, thumbnail_widths=None,
+                       thumbnail_format=CARD_THUMBNAIL_FORMAT, png_bytes=None):
+    """
+    从同一份解码后的卡片图像编码并保存所有需要的版本。
+
+    参数:
+        card_path: 卡片PNG的路径，其它版本保存在同一目录下
+        img: BGR卡片图像
+        formats: 全尺寸版本的格式列表，默认 CARD_EAGER_FORMATS
+        thumbnail_widths: 缩略图宽度列表，默认 CARD_THUMBNAIL_WIDTHS
+        thumbnail_format: 缩略图格式
+        png_bytes: 已有的PNG编码(如浏览器截图)，提供时直接写入而不重新编码
+
+    返回:
+        {(格式, 宽度或None): 文件路径}
+    """
+    formats = CARD_EAGER_FORMATS if formats is None else formats
+    thumbnail_widths = CARD_THUMBNAIL_WIDTHS if thumbnail_widths is None else thumbnail_widths
+    # 主文件 _card.png 总是需要的
+    if "png" not in formats:
+        formats = ["png"] + list(formats)
+
+    saved = {}
+    for fmt in formats:
+        data = png_bytes if fmt == "png" and png_bytes is not None else encode_image(img, fmt)
+        path = variant_path(card_path, fmt)
+        _write_atomic(path, data)
+        saved[(fmt, None)] = path
+
+    for width in thumbnail_widths:
+        path = variant_path(card_path, thumbnail_format, width)
+        _write_atomic(path, encode_image(resize_to_width(img, width), thumbnail_format))
+        saved[(thumbnail_format, width)] = path
+    return saved
+
+
+def _write_atomic(path, data):
+    """先写入本线程独有的临时文件再替换，读取方不会看到写了一半的文件"""
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def ensure_card_variant(card_path, fmt, width=None):
+    """返回卡片指定版本的路径，版本不存在时从卡片PNG按需生成"""
+    path = variant_path(card_path, fmt, width)
+    if os.path.exists(path):
+        return path
+    img = cv2.imread(card_path)
+    if img is None:
+        raise FileNotFoundError(f"无法读取卡片图片: {card_path}")
+    if width:
+        img = resize_to_width(img, width)
+    # 同一版本可能被多个请求同时生成，各自写临时文件后替换，后完成的覆盖先完成的
+    _write_atomic(path, encode_image(img, fmt))
+    logger.info(f"按需生成卡片版本: {path}")
+    return path
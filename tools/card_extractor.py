@@ -1,156 +1,620 @@
 import cv2
 import numpy as np
 import os
+import time
+import threading
 
-def extract_card_from_image(image_path, output_path, min_area=500, debug=False):
+from .extract_debug import DebugImages, debug_writer, should_sample
+
+# 投影快速路径参数
+PROJECTION_TOLERANCE = 6      # 与背景色的最大通道差，超过即视为内容像素
+PROJECTION_UNIFORMITY = 0.98  # 图片边框上属于背景色的像素比例下限，低于此值视为背景不均匀
+
+def find_card_box_projection(img, tolerance=PROJECTION_TOLERANCE, uniformity=PROJECTION_UNIFORMITY):
     """
-    从图片中提取包含所有文字/内容块的完整卡片区域，优先识别最大内容块。
+    快速路径：卡片位于近似纯色的背景上时，对非背景像素做行/列投影直接得到内容边界。
     
     参数：
-        image_path: 输入图片路径
-        output_path: 输出卡片图片路径
-        min_area: 最小文字块面积(像素)
-        debug: 是否保存调试图片
+        img: BGR图像
+        tolerance: 与背景色的最大通道差
+        uniformity: 边框像素中属于背景色的最小比例
+    
+    返回：
+        (x, y, w, h)；背景不均匀或没有任何内容时返回None，由形态学方法处理
     """
-    # 读取图片
-    img = cv2.imread(image_path)
-    if img is None:
-        print(f"无法读取图片: {image_path}")
-        return False
+    # 以四条边框像素的中位数作为背景色
+    border = np.concatenate([img[0], img[-1], img[:, 0], img[:, -1]])
+    bg = np.median(border, axis=0)
+    lower = np.clip(bg - tolerance, 0, 255)
+    upper = np.clip(bg + tolerance, 0, 255)
+    if np.count_nonzero(cv2.inRange(border[None], lower, upper)) < uniformity * len(border):
+        return None
     
-    original = img.copy()
-    height, width = img.shape[:2]
+    # 非背景像素的行/列投影
+    content = cv2.bitwise_not(cv2.inRange(img, lower, upper))
+    rows = np.flatnonzero(content.max(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(content.max(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+
+def _adaptive_threshold(gray, scale_factor=2):
+    """高斯模糊 + 自适应阈值，得到文字/边缘等内容像素的二值图"""
+    if scale_factor >= 1:
+        blur_kernel_size = max(3, int(3 * scale_factor))
+        if blur_kernel_size % 2 == 0: blur_kernel_size += 1
+        blurred = cv2.GaussianBlur(gray, (blur_kernel_size, blur_kernel_size), 0)
+    else:
+        # 缩小图像时的面积平均已经起到了去噪作用，再模糊会抹平低对比度的卡片边缘
+        blurred = gray
     
-    # 假设输入图像来自更高分辨率的源，设置缩放因子
-    # 如果图像本身就是原始分辨率，可以设为1
-    scale_factor = 2  # 根据实际情况调整
+    block_size = max(3, int(11 * scale_factor))
+    if block_size % 2 == 0: block_size += 1
+    return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                 cv2.THRESH_BINARY_INV, block_size, 2)
+
+def find_card_box_morphology(img, gray, min_area=500, debug=None, scale_factor=2, stats=None):
+    """
+    形态学方法：自适应阈值 + 形态学闭运算连接文字区域，以最大轮廓为主体并合并所有有效轮廓。
     
+    参数：
+        img: BGR图像
+        gray: 灰度图
+        min_area: 最小文字块面积(像素)
+        debug: 调试图像收集器 debug(名称, 图像)，提供时收集阈值图、连通图和最大轮廓
+        scale_factor: 输入图像相对原始分辨率的缩放因子，默认2(高分辨率截图)；
+                      在缩小后的图像上检测时相应减小
+        stats: 提供字典时写入轮廓总数(contours)和面积达标的轮廓数(kept_contours)
+    
+    返回：
+        (x, y, w, h)；没有足够大的内容轮廓时返回None
+    """
     # 根据缩放因子调整参数
     scaled_min_area = min_area * (scale_factor ** 2)
     
-    # 转换为灰度图
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
     # 预处理：高斯模糊 + 自适应阈值
-    blur_kernel_size = max(3, int(3 * scale_factor))
-    if blur_kernel_size % 2 == 0: blur_kernel_size += 1
-    blurred = cv2.GaussianBlur(gray, (blur_kernel_size, blur_kernel_size), 0)
-    
-    block_size = max(11, int(11 * scale_factor))
-    if block_size % 2 == 0: block_size += 1
-    thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                   cv2.THRESH_BINARY_INV, block_size, 2)
+    thresh = _adaptive_threshold(gray, scale_factor)
     
-    if debug:
-        cv2.imwrite(output_path.replace('.png', '_thresh.png'), thresh)
+    if debug is not None:
+        debug("thresh", thresh)
         
     # 形态学操作连接文字区域
-    kernel_h_size = max(15, int(15 * scale_factor))
-    kernel_v_size = max(15, int(15 * scale_factor))
+    kernel_h_size = max(3, int(15 * scale_factor))
+    kernel_v_size = max(3, int(15 * scale_factor))
     kernel_h = np.ones((1, kernel_h_size), np.uint8)
     kernel_v = np.ones((kernel_v_size, 1), np.uint8)
     connected = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel_h)
     connected = cv2.morphologyEx(connected, cv2.MORPH_CLOSE, kernel_v)
     
-    if debug:
-        cv2.imwrite(output_path.replace('.png', '_connected.png'), connected)
+    if debug is not None:
+        debug("connected", connected)
         
     # 查找轮廓
     contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if stats is not None:
+        stats["contours"] = len(contours)
+        stats["kept_contours"] = 0
+    if not contours:
+        print("未找到任何轮廓")
+        return None
     
     # --- 新思路：找到最大的轮廓作为主要卡片区域 --- 
     largest_contour = None
     max_area = 0
     all_contours_bbox = [] # 存储所有有效轮廓的边界框
     
-    if contours:
-        # 过滤掉面积过小的轮廓，并记录边界框
-        valid_contours = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area >= scaled_min_area:
-                valid_contours.append(contour)
-                all_contours_bbox.append(cv2.boundingRect(contour))
-                if area > max_area:
-                    max_area = area
-                    largest_contour = contour
-        
-        if largest_contour is not None:
-            # 获取最大轮廓的边界框
-            card_x, card_y, card_w, card_h = cv2.boundingRect(largest_contour)
-            
-            if debug:
-                debug_img = original.copy()
-                cv2.drawContours(debug_img, [largest_contour], -1, (0, 255, 0), 3)
-                cv2.rectangle(debug_img, (card_x, card_y), (card_x + card_w, card_y + card_h), (0, 0, 255), 2)
-                cv2.imwrite(output_path.replace('.png', '_largest_contour.png'), debug_img)
-            
-            # --- 微调边界以包含所有检测到的内容 --- 
-            if all_contours_bbox:
-                min_x, min_y = card_x, card_y
-                max_x, max_y = card_x + card_w, card_y + card_h
-                
-                for x_c, y_c, w_c, h_c in all_contours_bbox:
-                    min_x = min(min_x, x_c)
-                    min_y = min(min_y, y_c)
-                    max_x = max(max_x, x_c + w_c)
-                    max_y = max(max_y, y_c + h_c)
-                    
-                # 更新卡片边界以包含所有内容
-                card_x, card_y = min_x, min_y
-                card_w = max_x - min_x
-                card_h = max_y - min_y
-            
-            # --- 添加边距 --- 
-            # 根据卡片尺寸动态添加边距
-            padding_h = int(width * 0.015) # 水平边距 1.5%
-            padding_v = int(height * 0.015) # 垂直边距 1.5%
-            
-            x_start = max(0, card_x - padding_h)
-            y_start = max(0, card_y - padding_v)
-            x_end = min(width, card_x + card_w + padding_h)
-            y_end = min(height, card_y + card_h + padding_v)
-            
-            # 提取卡片区域
-            card = original[y_start:y_end, x_start:x_end]
-            
-            # 保存结果
-            cv2.imwrite(output_path, card)
-            print(f"卡片已提取保存到 {output_path} (基于最大内容块)")
-            return True
-        else:
-            print("未找到足够大的内容轮廓")
-    else:
-        print("未找到任何轮廓")
+    # 过滤掉面积过小的轮廓，并记录边界框
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area >= scaled_min_area:
+            all_contours_bbox.append(cv2.boundingRect(contour))
+            if area > max_area:
+                max_area = area
+                largest_contour = contour
+    
+    if stats is not None:
+        stats["kept_contours"] = len(all_contours_bbox)
+    if largest_contour is None:
+        print("未找到足够大的内容轮廓")
+        return None
+    
+    # 获取最大轮廓的边界框
+    card_x, card_y, card_w, card_h = cv2.boundingRect(largest_contour)
+    
+    if debug is not None:
+        def draw_largest_contour():
+            debug_img = img.copy()
+            cv2.drawContours(debug_img, [largest_contour], -1, (0, 255, 0), 3)
+            cv2.rectangle(debug_img, (card_x, card_y), (card_x + card_w, card_y + card_h), (0, 0, 255), 2)
+            return debug_img
+        # 复制原图并绘制推迟到后台线程
+        debug("largest_contour", draw_largest_contour)
+    
+    # --- 微调边界以包含所有检测到的内容 --- 
+    min_x, min_y = card_x, card_y
+    max_x, max_y = card_x + card_w, card_y + card_h
+    for x_c, y_c, w_c, h_c in all_contours_bbox:
+        min_x = min(min_x, x_c)
+        min_y = min(min_y, y_c)
+        max_x = max(max_x, x_c + w_c)
+        max_y = max(max_y, y_c + h_c)
+    
+    # 更新卡片边界以包含所有内容
+    return (min_x, min_y, max_x - min_x, max_y - min_y)
 
-    # 如果主要方法失败，尝试使用备用方法（如果需要，可以重新启用）
-    print("主要方法失败，尝试备用方法...")
+# 图像金字塔参数：大图先在缩小的图像上检测，再在原图边缘附近的窄带内细化
+PYRAMID_FACTOR = 3               # 缩小倍数，与截图的3倍像素比对应
+PYRAMID_MIN_PIXELS = 1_000_000   # 像素数超过此值才使用金字塔
 
-    # --- MSER备用方法 --- 
-    mser = cv2.MSER_create()
-    regions, _ = mser.detectRegions(gray)
-    if regions:
-        # ... (此处省略MSER逻辑，与之前类似，如果需要可以恢复) ...
-        # 如果MSER成功，保存并返回True
-        pass 
-
-    # --- Otsu备用方法 --- 
-    _, otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+def _refine_edges(img, box, band):
+    """
+    在原图上每条边附近宽 2*band 的窄带内重新定位内容边界，只处理窄带内的像素。
+    窄带内没有找到内容时保留粗略位置。
+    """
+    height, width = img.shape[:2]
+    x0, y0, x1, y1 = box
+
+    def content(x_start, x_end, y_start, y_end):
+        strip = cv2.cvtColor(img[y_start:y_end, x_start:x_end], cv2.COLOR_BGR2GRAY)
+        return _adaptive_threshold(strip)
+
+    # 纵向范围向外扩展band，避免漏掉靠近角落的内容
+    ry0, ry1 = max(0, y0 - band), min(height, y1 + band)
+    rx0, rx1 = max(0, x0 - band), min(width, x1 + band)
+
+    # 左右边：窄带内含有内容像素的列
+    left_start, left_end = max(0, x0 - band), min(width, x0 + band)
+    cols = np.flatnonzero(content(left_start, left_end, ry0, ry1).max(axis=0))
+    new_x0 = left_start + cols[0] if len(cols) else x0
+
+    right_start, right_end = max(0, x1 - band), min(width, x1 + band)
+    cols = np.flatnonzero(content(right_start, right_end, ry0, ry1).max(axis=0))
+    new_x1 = right_start + cols[-1] + 1 if len(cols) else x1
+
+    # 上下边：窄带内含有内容像素的行
+    top_start, top_end = max(0, y0 - band), min(height, y0 + band)
+    rows = np.flatnonzero(content(rx0, rx1, top_start, top_end).max(axis=1))
+    new_y0 = top_start + rows[0] if len(rows) else y0
+
+    bottom_start, bottom_end = max(0, y1 - band), min(height, y1 + band)
+    rows = np.flatnonzero(content(rx0, rx1, bottom_start, bottom_end).max(axis=1))
+    new_y1 = bottom_start + rows[-1] + 1 if len(rows) else y1
+
+    return (int(new_x0), int(new_y0), int(new_x1), int(new_y1))
+
+def find_card_box_pyramid(img, min_area=500, factor=PYRAMID_FACTOR, band=None, debug=None, stats=None):
+    """
+    由粗到细的卡片检测：在缩小 factor 倍的图像上运行形态学方法，把结果映射回原图，
+    再在每条边附近的窄带内用原图像素细化。耗时和峰值内存约降为原来的 1/factor²。
+    
+    参数：
+        img: BGR图像
+        min_area: 最小文字块面积(像素)，含义与形态学方法相同
+        factor: 缩小倍数
+        band: 细化窄带的半宽(原图像素)，默认为 4*factor
+        debug: 调试图像收集器，收集缩小图像上的中间结果
+        stats: 提供字典时写入缩小图像上的轮廓数
+    
+    返回：
+        (x, y, w, h)；没有找到内容时返回None
+    """
+    height, width = img.shape[:2]
+    # 裁掉不足一个缩小单位的余数行列，使缩放比例为整数，INTER_AREA 可走快速路径；
+    # 被裁掉的边缘像素由后面的原图细化覆盖
+    small_w, small_h = max(1, width // factor), max(1, height // factor)
+    small = cv2.resize(img[:small_h * factor, :small_w * factor], (small_w, small_h), interpolation=cv2.INTER_AREA)
+    
+    gray_small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    coarse = find_card_box_morphology(small, gray_small, min_area, debug, scale_factor=2 / factor, stats=stats)
+    if coarse is None:
+        return None
+    
+    # 映射回原图坐标
+    cx, cy, cw, ch = coarse
+    box = (cx * factor, cy * factor, min(width, (cx + cw) * factor), min(height, (cy + ch) * factor))
+    x0, y0, x1, y1 = _refine_edges(img, box, band or 4 * factor)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+# 备用方法参数：Otsu/MSER 在缩小到此像素数以内的灰度图上运行，耗时与原图大小无关
+FALLBACK_MAX_PIXELS = 2_000_000
+MSER_MIN_REGIONS = 3             # 至少找到这么多类文字区域才认为MSER的结果可信
+MSER_MAX_REGION_FRACTION = 0.25  # 超过图像面积此比例的区域视为背景块而不是文字
+
+def _downscale_gray(gray, max_pixels=FALLBACK_MAX_PIXELS):
+    """把灰度图按整数倍缩小到 max_pixels 以内，返回 (缩小后的图, 倍数)"""
+    height, width = gray.shape[:2]
+    factor = 1
+    while (height // factor) * (width // factor) > max_pixels:
+        factor += 1
+    if factor == 1:
+        return gray, 1
+    small_w, small_h = width // factor, height // factor
+    small = cv2.resize(gray[:small_h * factor, :small_w * factor], (small_w, small_h), interpolation=cv2.INTER_AREA)
+    return small, factor
+
+def _union_box(boxes, factor=1):
+    """多个 (x, y, w, h) 的并集，按 factor 映射回原图坐标"""
+    min_x = min(x for x, _, _, _ in boxes)
+    min_y = min(y for _, y, _, _ in boxes)
+    max_x = max(x + w for x, _, w, _ in boxes)
+    max_y = max(y + h for _, y, _, h in boxes)
+    return (min_x * factor, min_y * factor, (max_x - min_x) * factor, (max_y - min_y) * factor)
+
+def find_card_box_otsu(gray, min_area=500, stats=None):
+    """
+    Otsu备用方法：全局Otsu阈值 + 小核闭运算，合并所有面积达标的轮廓。
+    背景较暗(边框中位数低于128)时反转阈值方向，使内容总是前景。
+    
+    返回：
+        (x, y, w, h)；没有足够大的轮廓时返回None
+    """
+    small, factor = _downscale_gray(gray)
+    border = np.concatenate([small[0], small[-1], small[:, 0], small[:, -1]])
+    mode = cv2.THRESH_BINARY_INV if np.median(border) >= 128 else cv2.THRESH_BINARY
+    _, otsu = cv2.threshold(small, 0, 255, mode + cv2.THRESH_OTSU)
     kernel = np.ones((5, 5), np.uint8)
     morph = cv2.morphologyEx(otsu, cv2.MORPH_CLOSE, kernel)
     otsu_contours, _ = cv2.findContours(morph, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if otsu_contours:
-        # ... (此处省略Otsu逻辑，与之前类似，如果需要可以恢复) ...
-        # 如果Otsu成功，保存并返回True
-        pass
-
-    # 所有方法失败
-    print("所有方法均无法提取卡片内容区域，返回原始图像并进行超分处理")
-    # 使用线性插值将原始图像放大3倍
-    h, w = original.shape[:2]
-    resized_original = cv2.resize(original, (w * 3, h * 3), interpolation=cv2.INTER_LINEAR)
-    cv2.imwrite(output_path, resized_original)
-    return False
+    scaled_min_area = min_area / (factor ** 2)
+    boxes = [cv2.boundingRect(c) for c in otsu_contours if cv2.contourArea(c) >= scaled_min_area]
+    if stats is not None:
+        stats["otsu_contours"] = len(otsu_contours)
+        stats["otsu_kept_contours"] = len(boxes)
+    if not boxes:
+        return None
+    return _union_box(boxes, factor)
+
+def find_card_box_mser(gray, min_regions=MSER_MIN_REGIONS, max_region_fraction=MSER_MAX_REGION_FRACTION, stats=None):
+    """
+    MSER备用方法：检测稳定的类文字区域，合并所有大小合理的区域。
+    阈值类方法在渐变或纹理背景上失效时，MSER仍能找到文字。
+    
+    返回：
+        (x, y, w, h)；类文字区域少于 min_regions 时返回None
+    """
+    small, factor = _downscale_gray(gray)
+    mser = cv2.MSER_create()
+    _, bboxes = mser.detectRegions(small)
+    max_area = max_region_fraction * small.shape[0] * small.shape[1]
+    boxes = [tuple(int(v) for v in b) for b in bboxes if b[2] * b[3] <= max_area]
+    if stats is not None:
+        stats["mser_regions"] = len(bboxes)
+        stats["mser_kept_regions"] = len(boxes)
+    if len(boxes) < min_regions:
+        return None
+    return _union_box(boxes, factor)
+
+def pad_card_box(box, width, height):
+    """
+    根据图片尺寸动态添加边距(水平/垂直各1.5%)，并限制在图片范围内。
+    
+    返回：
+        (x_start, y_start, x_end, y_end)
+    """
+    card_x, card_y, card_w, card_h = box
+    padding_h = int(width * 0.015) # 水平边距 1.5%
+    padding_v = int(height * 0.015) # 垂直边距 1.5%
+    
+    x_start = max(0, card_x - padding_h)
+    y_start = max(0, card_y - padding_v)
+    x_end = min(width, card_x + card_w + padding_h)
+    y_end = min(height, card_y + card_h + padding_v)
+    return (x_start, y_start, x_end, y_end)
+
+class ExtractionResult:
+    """
+    一次卡片提取的诊断信息。布尔值表示是否成功提取，因此可以直接用在 if 判断中。
+    
+    属性：
+        ok: 是否提取到卡片
+        method: 最终采用的方法(projection / pyramid / morphology / otsu / mser)，失败时为None
+        box: 加边距后的裁剪区域 (x_start, y_start, x_end, y_end)，失败时为None
+        image_size: 输入图像的 (宽, 高)
+        timings: 各阶段耗时(毫秒)，只包含实际执行的阶段
+        contours: 各方法的轮廓/区域数，如 {"contours": 12, "kept_contours": 3}
+        stages: 级联中每一级的记录，如 {"stage": "projection", "ms": 0.8, "hit": False}
+        debug_sampled: 本次是否抽样保存了调试图片
+        image: 解码后的完整图像；card: 裁剪区域在 image 上的视图。两者不包含在 to_dict 中
+    """
+    
+    def __init__(self, image_size=None):
+        self.image = None
+        self.card = None
+        self.ok = False
+        self.method = None
+        self.box = None
+        self.image_size = image_size
+        self.timings = {}
+        self.contours = {}
+        self.debug_sampled = False
+        self.stages = []
+    
+    def __bool__(self):
+        return self.ok
+    
+    def to_dict(self):
+        return {
+            "ok": self.ok,
+            "method": self.method,
+            "box": list(self.box) if self.box else None,
+            "image_size": list(self.image_size) if self.image_size else None,
+            "timings": {k: round(v, 2) for k, v in self.timings.items()},
+            "contours": dict(self.contours),
+            "stages": list(self.stages),
+            "debug_sampled": self.debug_sampled,
+        }
+
+class _StageTimer:
+    """把 with 块的耗时累加到 timings[name](毫秒)"""
+    
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+    
+    def __exit__(self, *exc):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + (time.perf_counter() - self.start) * 1000
+
+def _load_image(image):
+    """把ndarray原样返回，编码后的字节(PNG/JPEG等)解码为BGR数组，字符串视为文件路径"""
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(image)
+
+def _parse_budgets(value):
+    budgets = {}
+    for item in value.split(","):
+        name, _, ms = item.partition("=")
+        if name.strip() and ms.strip():
+            budgets[name.strip()] = float(ms)
+    return budgets
+
+# 提取级联：按代价从低到高依次尝试，第一个可信结果即停止。
+# 每一级有自己的时间预算(毫秒)，整次提取有总预算。按该级的历史耗时预计会超出
+# 自己的预算或剩余总预算时跳过该级；实际耗时超出预算时记为超预算。
+# 第一级总是执行；之前的级别都没有找到任何区域时也不按历史耗时跳过。
+# 每次跳过都把该级的预计耗时乘以 EXTRACT_SKIP_DECAY，偶然的一次慢(GC、冷缓存)
+# 不会让该级永久被跳过：预计耗时降到预算以内后重新执行，再用实测值更新
+EXTRACT_TIME_BUDGET_MS = float(os.getenv("EXTRACT_TIME_BUDGET_MS", "1500"))
+EXTRACT_STAGE_BUDGETS = _parse_budgets(os.getenv(
+    "EXTRACT_STAGE_BUDGETS", "projection=50,pyramid=150,morphology=400,otsu=150,mser=400"))
+EXTRACT_SKIP_DECAY = float(os.getenv("EXTRACT_SKIP_DECAY", "0.8"))
+EXTRACT_MIN_BOX_FRACTION = 0.01  # 结果区域小于图像面积的此比例时不可信(多半是噪点或图标)
+EXTRACT_MAX_OUTPUT_PIXELS = int(os.getenv("EXTRACT_MAX_OUTPUT_PIXELS", "12000000"))
+
+class CascadeStats:
+    """
+    各级提取的累计统计：尝试/命中/跳过/超预算次数和耗时，用于判断哪些级别值得保留。
+    预计耗时按每百万像素耗时的指数滑动平均估计，被跳过时按 skip_decay 衰减。
+    """
+    
+    def __init__(self, skip_decay=EXTRACT_SKIP_DECAY):
+        self.skip_decay = skip_decay
+        self._lock = threading.Lock()
+        self._stages = {}
+    
+    def _entry(self, name):
+        return self._stages.setdefault(name, {
+            "attempts": 0, "hits": 0, "skipped": 0, "over_budget": 0,
+            "total_ms": 0.0, "max_ms": 0.0, "ms_per_mp": None,
+        })
+    
+    def predict_ms(self, name, megapixels):
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None or entry["ms_per_mp"] is None:
+                return None
+            return entry["ms_per_mp"] * megapixels
+    
+    def record(self, name, elapsed_ms, hit, megapixels, budget_ms=None):
+        with self._lock:
+            entry = self._entry(name)
+            entry["attempts"] += 1
+            entry["hits"] += bool(hit)
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            if budget_ms is not None and elapsed_ms > budget_ms:
+                entry["over_budget"] += 1
+            rate = elapsed_ms / max(megapixels, 0.01)
+            entry["ms_per_mp"] = rate if entry["ms_per_mp"] is None else 0.8 * entry["ms_per_mp"] + 0.2 * rate
+    
+    def record_skip(self, name):
+        with self._lock:
+            entry = self._entry(name)
+            entry["skipped"] += 1
+            if entry["ms_per_mp"] is not None:
+                entry["ms_per_mp"] *= self.skip_decay
+    
+    def stats(self):
+        with self._lock:
+            result = {}
+            for name, entry in self._stages.items():
+                attempts = entry["attempts"]
+                result[name] = {
+                    "attempts": attempts,
+                    "hits": entry["hits"],
+                    "hit_rate": round(entry["hits"] / attempts, 3) if attempts else None,
+                    "skipped": entry["skipped"],
+                    "over_budget": entry["over_budget"],
+                    "avg_ms": round(entry["total_ms"] / attempts, 1) if attempts else None,
+                    "max_ms": round(entry["max_ms"], 1),
+                }
+            return result
+
+cascade_stats = CascadeStats()
+
+def extraction_stats():
+    """本进程内各级提取的累计统计"""
+    return cascade_stats.stats()
+
+def extraction_settings():
+    """影响提取结果的配置，用于渲染缓存键：配置变化后旧的缓存条目不再命中"""
+    return {
+        "projection": [PROJECTION_TOLERANCE, PROJECTION_UNIFORMITY],
+        "pyramid": [PYRAMID_FACTOR, PYRAMID_MIN_PIXELS],
+        "fallback_max_pixels": FALLBACK_MAX_PIXELS,
+        "mser": [MSER_MIN_REGIONS, MSER_MAX_REGION_FRACTION],
+        "time_budget_ms": EXTRACT_TIME_BUDGET_MS,
+        "stage_budgets": EXTRACT_STAGE_BUDGETS,
+        "skip_decay": EXTRACT_SKIP_DECAY,
+        "min_box_fraction": EXTRACT_MIN_BOX_FRACTION,
+        "max_output_pixels": EXTRACT_MAX_OUTPUT_PIXELS,
+    }
+
+def _is_confident(box, width, height, min_fraction=EXTRACT_MIN_BOX_FRACTION):
+    """结果区域非空且不小于图像面积的 min_fraction 时才停止级联"""
+    if box is None:
+        return False
+    _, _, w, h = box
+    return w > 0 and h > 0 and w * h >= min_fraction * width * height
+
+def extract_card(image, min_area=500, debug=None, fast=True, pyramid=True, debug_name=None,
+                 time_budget_ms=EXTRACT_TIME_BUDGET_MS, stage_budgets=None):
+    """
+    在内存中定位卡片区域，不读写任何文件。
+    
+    按代价从低到高依次尝试：背景投影 -> 金字塔(大图) -> 全分辨率形态学 -> Otsu -> MSER，
+    第一个可信结果即停止。Otsu/MSER 的结果不如形态学可靠，因此排在其后作为备用。
+    
+    参数：
+        image: BGR图像(ndarray)或编码后的图片字节(如浏览器截图PNG)
+        min_area: 最小文字块面积(像素)，形态学和Otsu方法使用
+        debug: 是否保存调试图片。None 时按 EXTRACT_DEBUG_SAMPLE_RATE 抽样；
+               调试图片由后台线程编码，保存在 EXTRACT_DEBUG_DIR 中
+        fast: 是否先尝试背景投影快速路径，背景不均匀时自动退回后续方法
+        pyramid: 大图是否在缩小的图像上运行形态学方法并在原图边缘细化
+        debug_name: 调试图片的文件名前缀
+        time_budget_ms: 整次提取的时间预算(毫秒)
+        stage_budgets: 各级的时间预算 {级别: 毫秒}，默认 EXTRACT_STAGE_BUDGETS
+    
+    返回：
+        ExtractionResult。成功时 result.box 为裁剪区域 (x_start, y_start, x_end, y_end)，
+        result.card 为源图像上的切片视图(不复制像素，修改源图像会反映到卡片上)；
+        result.image 为解码后的完整图像；result.stages 记录每一级的耗时和结果
+    """
+    result = ExtractionResult()
+    timings = result.timings
+    started = time.perf_counter()
+    stage_budgets = EXTRACT_STAGE_BUDGETS if stage_budgets is None else stage_budgets
+    
+    with _StageTimer(timings, "decode"):
+        img = _load_image(image)
+    if img is None:
+        print("无法解码图片")
+        return result
+    
+    result.image = img
+    height, width = img.shape[:2]
+    megapixels = height * width / 1_000_000
+    result.image_size = (width, height)
+    debug_images = DebugImages() if should_sample(debug) else None
+    result.debug_sampled = debug_images is not None
+    
+    # 灰度图由形态学、Otsu、MSER 共用，只在需要时计算一次
+    gray_cache = []
+    def gray():
+        if not gray_cache:
+            gray_cache.append(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+        return gray_cache[0]
+    
+    stages = []
+    if fast:
+        stages.append(("projection", lambda: find_card_box_projection(img)))
+    if pyramid and height * width >= PYRAMID_MIN_PIXELS:
+        stages.append(("pyramid", lambda: find_card_box_pyramid(img, min_area, debug=debug_images,
+                                                                stats=result.contours)))
+    stages.append(("morphology", lambda: find_card_box_morphology(img, gray(), min_area, debug_images,
+                                                                  stats=result.contours)))
+    stages.append(("otsu", lambda: find_card_box_otsu(gray(), min_area, stats=result.contours)))
+    stages.append(("mser", lambda: find_card_box_mser(gray(), stats=result.contours)))
+    
+    box = None
+    found_any = False  # 之前的级别是否找到过区域(即使不可信)
+    for index, (name, find_box) in enumerate(stages):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        predicted = cascade_stats.predict_ms(name, megapixels)
+        stage_budget = stage_budgets.get(name)
+        if found_any and predicted is not None:
+            if stage_budget is not None and predicted > stage_budget:
+                reason = "stage_budget"
+            elif elapsed_ms + predicted > time_budget_ms:
+                reason = "time_budget"
+            else:
+                reason = None
+            if reason:
+                cascade_stats.record_skip(name)
+                result.stages.append({"stage": name, "skipped": True, "reason": reason,
+                                      "predicted_ms": round(predicted, 1)})
+                continue
+        with _StageTimer(timings, name):
+            box = find_box()
+        found_any = found_any or box is not None
+        hit = _is_confident(box, width, height)
+        cascade_stats.record(name, timings[name], hit, megapixels, stage_budget)
+        result.stages.append({"stage": name, "ms": round(timings[name], 2), "hit": hit})
+        if hit:
+            result.method = name
+            break
+        box = None
+    
+    if box is not None:
+        # --- 添加边距 --- 
+        x_start, y_start, x_end, y_end = pad_card_box(box, width, height)
+        result.ok = True
+        result.box = (x_start, y_start, x_end, y_end)
+        # 卡片区域是源图像的视图，不复制
+        result.card = img[y_start:y_end, x_start:x_end]
+    else:
+        print("所有方法均无法提取卡片内容区域")
+    
+    if debug_images is not None:
+        debug_writer.submit(debug_name or f"extract_{int(time.time() * 1000)}", debug_images, result.to_dict())
+    return result
+
+def limit_output_size(img, max_pixels=EXTRACT_MAX_OUTPUT_PIXELS):
+    """像素数超过 max_pixels 时等比缩小(INTER_AREA)，否则原样返回"""
+    height, width = img.shape[:2]
+    if height * width <= max_pixels:
+        return img
+    scale = (max_pixels / (height * width)) ** 0.5
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+def extract_card_from_image(image_path, output_path, min_area=500, debug=None, writer=None, fast=True, pyramid=True):
+    """
+    从图片中提取包含所有文字/内容块的完整卡片区域并保存，是 extract_card 的文件接口。
+    
+    参数：
+        image_path: 输入图片路径，也可以是已解码的BGR图像或编码后的图片字节
+        output_path: 输出卡片图片路径
+        min_area、debug、fast、pyramid: 同 extract_card
+        writer: 保存卡片的函数 writer(output_path, card)，默认 cv2.imwrite，
+                可用于一次编码出多种格式和尺寸
+    
+    返回：
+        ExtractionResult，成功提取时为真
+    """
+    debug_name = os.path.splitext(os.path.basename(output_path))[0]
+    result = extract_card(image_path, min_area, debug, fast, pyramid, debug_name=debug_name)
+    if result.image is None:
+        print(f"无法读取图片: {image_path}")
+        return result
+    
+    if result:
+        # 保存结果
+        with _StageTimer(result.timings, "write"):
+            (writer or cv2.imwrite)(output_path, result.card)
+        print(f"卡片已提取保存到 {output_path} ({result.method})")
+        return result
+
+    # 所有方法失败时保存原图，超过输出像素上限时缩小
+    print("所有方法均无法提取卡片内容区域，保存原始图像")
+    (writer or cv2.imwrite)(output_path, limit_output_size(result.image))
+    return result
 
 # 示例用法
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+"""
+离线批量卡片提取
+
+调整提取参数后需要对大量历史截图重新提取。这里遍历目录或通配符匹配到的图片，
+分发到进程池中并行提取(OpenCV 计算不适合放在共享GIL的线程池中)，
+每完成一张就向 JSONL 清单追加一行结果，输出比输入新的文件直接跳过，
+最后报告吞吐量和单张耗时的分位数。
+
+用法：
+    python -m tools.extract_batch 截图目录或通配符 [...] -o 输出目录 [--workers 8] [--force]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+
+def _glob_root(pattern):
+    """通配符中第一个含通配字符的路径部分之前的目录，如 'shots/*/a/*.png' -> 'shots'"""
+    parts = pattern.replace(os.sep, "/").split("/")
+    static = []
+    for part in parts[:-1]:
+        if glob.has_magic(part):
+            break
+        static.append(part)
+    return "/".join(static) or ("/" if pattern.startswith("/") else ".")
+
+
+def _is_within(path, directory):
+    return os.path.commonpath([path, directory]) == directory
+
+
+def _walk(root, excluded):
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(directory, d)) not in excluded]
+        yield from (os.path.join(directory, f) for f in files)
+
+
+def iter_inputs(patterns, recursive=True, exclude=None):
+    """
+    展开输入：目录下的图片(默认递归)、通配符匹配的图片或单个文件。
+    产出 (输入路径, 相对路径)，相对路径用于在输出目录中保持原有的目录结构：
+    目录输入相对于该目录，通配符相对于其中不含通配字符的前缀目录。
+    exclude 中的目录(如位于输入目录中的输出目录)不会被遍历。
+    """
+    excluded = [os.path.abspath(d) for d in (exclude or [])]
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            if recursive:
+                paths = _walk(root, excluded)
+            else:
+                paths = (os.path.join(root, f) for f in os.listdir(root))
+        else:
+            root = _glob_root(pattern)
+            paths = glob.glob(pattern, recursive=True)
+        for path in sorted(paths):
+            if not path.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(path):
+                continue
+            key = os.path.abspath(path)
+            if key in seen or any(_is_within(key, d) for d in excluded):
+                continue
+            seen.add(key)
+            yield path, os.path.relpath(path, root)
+
+
+def output_path_for(rel, output_dir, suffix="_card.png"):
+    return os.path.join(output_dir, os.path.splitext(rel)[0] + suffix)
+
+
+def is_up_to_date(input_path, output_path):
+    """输出存在且不比输入旧时无需重新提取"""
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+
+def _init_worker():
+    # 每个进程只用一个OpenCV线程，并行度由进程数决定，避免线程过度订阅
+    import cv2
+    cv2.setNumThreads(1)
+    # 提取过程的诊断输出写到 stderr，stdout 只留给最后的 JSON 汇总
+    sys.stdout = sys.stderr
+
+
+def _extract_one(input_path, output_path, options):
+    """在 worker 进程中提取一张图片，返回清单记录"""
+    from .card_extractor import extract_card_from_image
+
+    start = time.perf_counter()
+    record = {"input": input_path, "output": output_path}
+    try:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        result = extract_card_from_image(input_path, output_path, debug=False, **options)
+        record.update(result.to_dict())
+        record["status"] = "ok" if result else "failed"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return record
+
+
+def percentile(sorted_values, q):
+    """已排序列表的 q 分位数(最近秩法)"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_batch(patterns, output_dir, manifest_path=None, workers=None, force=False, suffix="_card.png",
+              recursive=True, options=None, progress=True):
+    """
+    并行提取所有输入图片，逐条写入清单，返回汇总信息。
+
+    参数:
+        patterns: 目录、通配符或文件路径列表
+        output_dir: 卡片输出目录
+        manifest_path: JSONL 清单路径，默认 <output_dir>/manifest.jsonl
+        workers: 进程数，默认CPU核数
+        force: 为True时不跳过已是最新的输出
+        options: 传给 extract_card_from_image 的参数，如 min_area/fast/pyramid
+    """
+    workers = workers or os.cpu_count() or 1
+    options = options or {}
+    manifest_path = manifest_path or os.path.join(output_dir, "manifest.jsonl")
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+
+    counts = {"ok": 0, "failed": 0, "error": 0, "skipped": 0}
+    latencies = []
+    start = time.perf_counter()
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+
+        def emit(record):
+            counts[record["status"]] += 1
+            if "elapsed_ms" in record:
+                latencies.append(record["elapsed_ms"])
+            manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+            manifest.flush()
+            if progress:
+                done = sum(counts.values())
+                print(f"[{done}] {record['status']:<7} {record['input']}", file=sys.stderr)
+
+        # 限制同时在途的任务数，输入很多时不会一次性把所有任务放进队列
+        pending = set()
+        max_pending = workers * 4
+        for input_path, rel in iter_inputs(patterns, recursive, exclude=[output_dir]):
+            output_path = output_path_for(rel, output_dir, suffix)
+            if not force and is_up_to_date(input_path, output_path):
+                emit({"input": input_path, "output": output_path, "status": "skipped"})
+                continue
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    emit(future.result())
+            pending.add(pool.submit(_extract_one, input_path, output_path, options))
+        for future in wait(pending).done:
+            emit(future.result())
+
+    wall = time.perf_counter() - start
+    latencies.sort()
+    processed = len(latencies)
+    return {
+        "manifest": manifest_path,
+        "workers": workers,
+        **counts,
+        "wall_s": round(wall, 2),
+        "files_per_second": round(processed / wall, 2) if wall > 0 else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量卡片提取")
+    parser.add_argument("inputs", nargs="+", help="截图目录、通配符(如 'shots/**/*.png')或文件路径")
+    parser.add_argument("-o", "--output-dir", required=True, help="卡片输出目录，保持输入的相对目录结构")
+    parser.add_argument("--manifest", help="JSONL 清单路径，默认 <输出目录>/manifest.jsonl")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认CPU核数")
+    parser.add_argument("--suffix", default="_card.png", help="输出文件名后缀")
+    parser.add_argument("--force", action="store_true", help="不跳过已是最新的输出")
+    parser.add_argument("--no-recursive", action="store_true", help="目录输入不递归子目录")
+    parser.add_argument("--min-area", type=int, default=500, help="最小文字块面积(像素)")
+    parser.add_argument("--no-fast", action="store_true", help="不使用背景投影快速路径")
+    parser.add_argument("--no-pyramid", action="store_true", help="不使用金字塔检测")
+    parser.add_argument("--quiet", action="store_true", help="不逐条打印进度")
+    args = parser.parse_args()
+
+    options = {"min_area": args.min_area, "fast": not args.no_fast, "pyramid": not args.no_pyramid}
+    summary = run_batch(args.inputs, args.output_dir, args.manifest, args.workers, args.force, args.suffix,
+                        recursive=not args.no_recursive, options=options, progress=not args.quiet)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary["error"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,175 @@
+"""
+卡片提取的抽样调试图片
+
+调试图片(阈值图、连通图、最大轮廓)都是全尺寸PNG，每次请求都写会让编码和磁盘开销翻几倍。
+这里只对抽样到的请求收集中间图像，由后台线程编码后写入单独的目录，目录按总大小上限
+淘汰最旧的文件；提取流程本身只多做几次引用保存，不做任何编码。
+"""
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from collections import OrderedDict
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_DEBUG_SAMPLE_RATE = float(os.getenv("EXTRACT_DEBUG_SAMPLE_RATE", "0"))  # 0~1，0表示只在显式要求时保存
+EXTRACT_DEBUG_DIR = os.getenv("EXTRACT_DEBUG_DIR", os.path.join("output", "extract_debug"))
+EXTRACT_DEBUG_MAX_MB = float(os.getenv("EXTRACT_DEBUG_MAX_MB", "128"))
+EXTRACT_DEBUG_QUEUE_SIZE = int(os.getenv("EXTRACT_DEBUG_QUEUE_SIZE", "8"))
+
+
+def should_sample(debug=None, rate=EXTRACT_DEBUG_SAMPLE_RATE):
+    """debug 为 True/False 时按其决定，为 None 时按抽样率随机决定"""
+    if debug is not None:
+        return bool(debug)
+    return rate > 0 and random.random() < rate
+
+
+class DebugImages:
+    """
+    一次提取过程中收集的调试图像。
+
+    add 的图像可以是数组，也可以是返回数组的函数(如在原图上画轮廓)，
+    函数在后台线程中才执行，避免在请求路径上复制整张图。
+    """
+
+    def __init__(self):
+        self.images = []
+
+    def add(self, name, image):
+        self.images.append((name, image))
+
+    def __call__(self, name, image):
+        self.add(name, image)
+
+    def __len__(self):
+        return len(self.images)
+
+
+class DebugImageWriter:
+    """
+    后台编码并保存调试图片的线程，目录大小有上限。
+
+    参数:
+        directory: 调试图片目录
+        max_bytes: 目录中文件总大小上限，超出时删除最旧的文件
+        max_queue: 等待编码的任务数上限，队列满时直接丢弃新任务
+    """
+
+    def __init__(self, directory=EXTRACT_DEBUG_DIR, max_bytes=int(EXTRACT_DEBUG_MAX_MB * 1024 * 1024),
+                 max_queue=EXTRACT_DEBUG_QUEUE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._files = OrderedDict()  # 文件名 -> 大小，按写入时间排序
+        self._bytes = 0
+        self.written = 0
+        self.dropped = 0
+        self.evicted = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._files.clear()
+        self._bytes = 0
+        entries = []
+        for name in os.listdir(self.directory):
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._bytes += size
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._load()
+                self._thread = threading.Thread(target=self._run, name="extract-debug", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def submit(self, prefix, images, diagnostics=None):
+        """
+        把一次提取的调试图像交给后台线程，文件名为 <prefix>_<name>.png。
+        队列已满时丢弃并返回False。
+        """
+        if not images and diagnostics is None:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((prefix, list(images.images if isinstance(images, DebugImages) else images),
+                                    diagnostics))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            prefix, images, diagnostics = job
+            for name, image in images:
+                try:
+                    if callable(image):
+                        image = image()
+                    ok, buf = cv2.imencode(".png", image)
+                    if ok:
+                        self._write(f"{prefix}_{name}.png", buf.tobytes())
+                except Exception as e:
+                    logger.warning(f"保存调试图片失败 {prefix}_{name}: {e}")
+            if diagnostics is not None:
+                data = json.dumps(diagnostics, ensure_ascii=False, indent=2, default=str).encode("utf-8")
+                self._write(f"{prefix}_diagnostics.json", data)
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            logger.warning(f"写入调试文件失败 {path}: {e}")
+            return
+        self._bytes += len(data) - self._files.pop(name, 0)
+        self._files[name] = len(data)
+        self.written += 1
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            old, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self.evicted += 1
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self, timeout=10):
+        """等待已提交的调试图片写完后结束后台线程"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+
+debug_writer = DebugImageWriter()
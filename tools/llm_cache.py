@@ -0,0 +1,227 @@
+"""
+LLM 响应缓存
+
+同一篇文章的总结、相同的 PROMPT 生成请求很常见，每次都是一次完整的付费调用。
+这里以 (服务商, 模型, 系统提示词, 用户提示词, 温度) 为键缓存响应文本：内存LRU在前，
+磁盘存储在后，条目有过期时间(TTL)，磁盘按总大小上限淘汰最久未使用的条目。
+调用方可以按请求跳过缓存，以获得新的采样结果。
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False")
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join("output", "llm_cache"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # 秒
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "64"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+
+
+def llm_cache_key(provider, model, sys_prompt, prompt, temperature):
+    """由服务商、模型、系统提示词、用户提示词和温度共同决定的缓存键"""
+    payload = json.dumps([provider, model, sys_prompt or "", prompt, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    两级LLM响应缓存，每个磁盘条目是一个 <key>.json 文件。
+
+    参数:
+        directory: 磁盘缓存目录
+        ttl: 条目有效期(秒)
+        max_bytes: 磁盘条目总大小上限
+        memory_entries: 内存LRU的条目数
+    """
+
+    def __init__(self, directory=LLM_CACHE_DIR, ttl=LLM_CACHE_TTL, max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024),
+                 memory_entries=LLM_CACHE_MEMORY_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (过期时间, 文本)
+        self._index = OrderedDict()   # key -> 磁盘文件大小，按最近使用排序
+        self._bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.expired = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-5], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            self._remove_file(key)
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _drop(self, key):
+        self._memory.pop(key, None)
+        size = self._index.pop(key, None)
+        if size is not None:
+            self._bytes -= size
+            self._remove_file(key)
+
+    def _remember(self, key, expires_at, text):
+        self._memory[key] = (expires_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """返回缓存的响应文本，未命中或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                self.expired += 1
+                self._drop(key)
+                self.misses += 1
+                return None
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(self._path(key))
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取LLM缓存失败 {key[:12]}: {e}")
+            with self._lock:
+                self._drop(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            if data["expires_at"] <= now:
+                self.expired += 1
+                self.misses += 1
+                self._drop(key)
+                return None
+            self.disk_hits += 1
+            self._remember(key, data["expires_at"], data["text"])
+        return data["text"]
+
+    def put(self, key, text, ttl=None):
+        """缓存一条响应文本，同时写入内存和磁盘"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        data = json.dumps({"expires_at": expires_at, "text": text}, ensure_ascii=False).encode("utf-8")
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            self._remember(key, expires_at, text)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入LLM缓存失败 {key[:12]}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._bytes += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._evict()
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": LLM_CACHE_ENABLED,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "bypassed": self.bypassed,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+llm_cache = LLMCache()
+
+
+def lookup_llm_cache(provider, model, sys_prompt, prompt, temperature, use_cache=True):
+    """
+    所有LLM调用路径共用的缓存查询(会读磁盘，异步调用方应放到线程中执行)。
+    use_cache=False 时跳过读取缓存并计入 bypassed，新结果仍应通过返回的键写入缓存。
+
+    返回:
+        (缓存键, 缓存的响应文本)。缓存关闭时键为None；未命中或跳过缓存时文本为None
+    """
+    if not LLM_CACHE_ENABLED:
+        return None, None
+    key = llm_cache_key(provider, model, sys_prompt, prompt, temperature)
+    if not use_cache:
+        llm_cache.record_bypass()
+        return key, None
+    cached = llm_cache.get(key)
+    if cached is not None:
+        logger.info(f"LLM缓存命中: {provider}/{model} {key[:12]}")
+    return key, cached
+
+
+async def cached_llm_call(provider, model, sys_prompt, prompt, temperature, call, use_cache=True):
+    """
+    先查缓存，未命中时 await call() 并缓存结果；调用失败不缓存。
+    use_cache=False 时跳过读取缓存(仍用新结果更新缓存)，用于需要重新采样的请求。
+    """
+    if not LLM_CACHE_ENABLED:
+        return await call()
+    key, cached = await asyncio.to_thread(lookup_llm_cache, provider, model, sys_prompt, prompt, temperature,
+                                          use_cache)
+    if cached is not None:
+        return cached
+    text = await call()
+    await asyncio.to_thread(llm_cache.put, key, text)
+    return text
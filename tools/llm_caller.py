@@ -1,10 +1,15 @@
 import os
+import time
 import asyncio
 import logging
 import httpx
-from openai import OpenAI
 from dotenv import load_dotenv
 from fastapi import HTTPException # Re-import HTTPException if needed for raising errors
+from .llm_clients import llm_clients
+from .llm_cache import cached_llm_call, llm_cache_key
+from .llm_governor import LLMBusy, PRIORITY_NORMAL, get_governor
+from .llm_tokens import PromptTooLarge, enforce_input_budget, estimate_tokens, max_tokens_kwargs, token_usage
+from .llm_hedge import LLM_HEDGE_ENABLED, LLM_HEDGE_SECONDARY_MODEL, llm_hedger, record_latency
 load_dotenv()
 # Configure logging (can inherit from main app or configure separately)
 logger = logging.getLogger(__name__)
@@ -27,8 +32,12 @@ DEFAULT_ORIGINAL_MODEL = "ep-m-20250330105359-r7wqp" # Or "deepseek-chat" if pre
 
 # --- Internal LLM Call Functions ---
 
-async def _call_original_llm(prompt: str, model: str, temperature: float) -> str:
-    """Internal function to call the LLM using the original httpx method."""
+async def _call_original_llm(prompt: str, model: str, temperature: float, priority: int = PRIORITY_NORMAL, sys_prompt: str = None) -> str:
+    """
+    Internal function to call the LLM using the shared pooled httpx client.
+    sys_prompt is only sent when given (hedged requests pass it so both providers
+    answer the same request; the plain fallback path still omits it).
+    """
     if not DEEPSEEK_API_KEY:
         logger.error("DEEPSEEK_API_KEY environment variable not set for original LLM call.")
         # Raise HTTPException directly if this function needs to interact with FastAPI error handling
@@ -39,41 +48,56 @@ async def _call_original_llm(prompt: str, model: str, temperature: float) -> str
         "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
         "Content-Type": "application/json",
     }
+    messages = [{"role": "system", "content": sys_prompt}] if sys_prompt else []
+    messages.append({"role": "user", "content": prompt})
     payload = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}],
+        "messages": messages,
         "temperature": temperature,
+        **max_tokens_kwargs(),
     }
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(DEEPSEEK_API_URL, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            if data.get('choices') and len(data['choices']) > 0:
-                return data['choices'][0]['message']['content']
-            else:
-                logger.error(f"LLM API response missing expected data: {data}")
-                raise HTTPException(status_code=500, detail="Invalid LLM API response (original method)")
-        except httpx.RequestError as e:
-            logger.error(f"Error calling original LLM API: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to connect to LLM API (original method): {e}")
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Original LLM API request failed: {e.response.status_code} - {e.response.text}")
-            raise HTTPException(status_code=e.response.status_code, detail=f"LLM API error (original method): {e.response.text}")
-
-async def _call_ark_llm(prompt: str, model: str, temperature: float, sys_prompt: str = None) -> str:
-    """Internal function to call the Ark LLM platform using the OpenAI client."""
+    client = llm_clients.deepseek()
+
+    async def post():
+        # Only the upstream request is timed; governor queueing and retry backoff
+        # would inflate the latency percentile that hedging relies on
+        started = time.monotonic()
+        response = await client.post(DEEPSEEK_API_URL, headers=headers, json=payload)
+        response.raise_for_status()
+        record_latency("deepseek", time.monotonic() - started)
+        return response
+
+    try:
+        # Rate limiting, queueing and retries on 429/5xx are handled by the governor
+        response = await get_governor("deepseek", model).call(post, priority)
+        data = response.json()
+        if data.get('choices') and len(data['choices']) > 0:
+            content = data['choices'][0]['message']['content']
+            token_usage.record("deepseek", model, estimate_tokens(sys_prompt) + estimate_tokens(prompt),
+                               data.get('usage'), content)
+            return content
+        else:
+            logger.error(f"LLM API response missing expected data: {data}")
+            raise HTTPException(status_code=500, detail="Invalid LLM API response (original method)")
+    except LLMBusy as e:
+        logger.error(f"Original LLM API is overloaded: {e}")
+        raise HTTPException(status_code=503, detail=f"LLM service is busy, please retry later: {e}")
+    except httpx.RequestError as e:
+        logger.error(f"Error calling original LLM API: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to connect to LLM API (original method): {e}")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Original LLM API request failed: {e.response.status_code} - {e.response.text}")
+        raise HTTPException(status_code=e.response.status_code, detail=f"LLM API error (original method): {e.response.text}")
+
+async def _call_ark_llm(prompt: str, model: str, temperature: float, sys_prompt: str = None, priority: int = PRIORITY_NORMAL) -> str:
+    """Internal function to call the Ark LLM platform using the shared AsyncOpenAI client."""
     if not ARK_API_KEY:
         logger.error("ARK_API_KEY environment variable not set.")
         raise HTTPException(status_code=500, detail="LLM API key not configured (Ark method)")
 
     try:
-        client = OpenAI(
-            api_key=ARK_API_KEY,
-            base_url=ARK_BASE_URL,
-            timeout=1800.0, # 1800 seconds = 30 minutes
-        )
+        client = llm_clients.ark()
 
         logger.info(f"Sending request to Ark LLM. Model: {model}, Temperature: {temperature}")
 
@@ -82,26 +106,100 @@ async def _call_ark_llm(prompt: str, model: str, temperature: float, sys_prompt:
             messages.append({"role": "system", "content": sys_prompt})
         messages.append({"role": "user", "content": prompt})
 
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model=model, # User specifies the Ark model ID here
-            messages=messages,
-            temperature=temperature
-        )
+        async def create():
+            # Time only the upstream call, not governor queueing or retries
+            started = time.monotonic()
+            response = await client.chat.completions.create(
+                model=model, # User specifies the Ark model ID here
+                messages=messages,
+                temperature=temperature,
+                **max_tokens_kwargs()
+            )
+            record_latency("ark", time.monotonic() - started)
+            return response
+
+        response = await get_governor("ark", model).call(create, priority)
 
         if hasattr(response.choices[0].message, 'reasoning_content'):
             logger.info(f"LLM Reasoning Content: {response.choices[0].message.reasoning_content}")
 
-        return response.choices[0].message.content
+        content = response.choices[0].message.content
+        token_usage.record("ark", model, estimate_tokens(sys_prompt) + estimate_tokens(prompt),
+                           getattr(response, 'usage', None), content)
+        return content
 
+    except LLMBusy as e:
+        logger.error(f"Ark LLM API is overloaded: {e}")
+        raise HTTPException(status_code=503, detail=f"LLM service is busy, please retry later: {e}")
     except Exception as e: # Catch potential OpenAI client errors
         logger.error(f"Error calling Ark LLM API: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to call LLM API (Ark method): {e}")
 
 
+# --- Request Coalescing ---
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is in flight,
+    later callers wait for it instead of starting another upstream request, and
+    all of them receive the same result. Errors are propagated to every waiter
+    and are not cached; the next call after completion starts a new request.
+
+    The shared call runs in its own task, so one waiter being cancelled (e.g. a
+    client disconnect) does not affect the others. The upstream call is only
+    cancelled once every waiter has gone away.
+
+    A key of None runs the call on its own: callers that asked for a fresh
+    sample (use_cache=False) must not share a completion with each other.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> [task, number of waiters]
+        self.calls = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    async def do(self, key, call):
+        if key is None:
+            self.bypassed += 1
+            return await call()
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(call())
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._forget(key, entry))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight LLM call {key[:12]} ({entry[1]} waiting)")
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+
+    def _forget(self, key, entry):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    def stats(self):
+        return {
+            "in_flight": len(self._inflight),
+            "waiting": sum(entry[1] for entry in self._inflight.values()),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+        }
+
+
+llm_singleflight = SingleFlight()
+
+
 # --- Public Function ---
 
-async def generate_content_with_llm(prompt: str, model: str | None = None, temperature: float = 0.7, sys_prompt: str = None) -> str:
+async def generate_content_with_llm(prompt: str, model: str | None = None, temperature: float = 0.7, sys_prompt: str = None, use_cache: bool = True, priority: int = PRIORITY_NORMAL, hedge: bool | None = None) -> str:
     """
     Generates content using the appropriate LLM based on available API keys.
 
@@ -110,24 +208,71 @@ async def generate_content_with_llm(prompt: str, model: str | None = None, tempe
         model: The specific model ID to use. If None, uses defaults based on API key.
         temperature: The generation temperature.
         sys_prompt: Optional system prompt to use for the LLM request.
+        use_cache: Whether to return a cached response for an identical request.
+                   Pass False to get a fresh sample (the cache is still updated).
+        priority: Queueing priority when the provider's concurrency limit is
+                  reached (see llm_governor; lower values are served first).
+        hedge: Send the request to DeepSeek as well when Ark has not answered
+               within its recent latency percentile, and use whichever answers
+               first (see llm_hedge). Defaults to LLM_HEDGE_ENABLED; requires
+               both API keys.
+
+    Identical concurrent calls (same model, prompts and temperature) share one
+    upstream request; see SingleFlight. Calls with use_cache=False are never
+    coalesced, so each one gets its own fresh sample.
+
+    The estimated input size is checked against LLM_MAX_INPUT_TOKENS before any
+    network I/O; over-budget prompts are rejected or truncated (see llm_tokens).
 
     Returns:
         The generated content string.
 
     Raises:
-        HTTPException: If API keys are missing or API calls fail.
+        HTTPException: If API keys are missing or API calls fail (503 when the
+                       provider keeps throttling or the wait queue times out,
+                       413 when the prompt exceeds the input token budget).
     """
-    if ARK_API_KEY:
+    try:
+        # The original method drops the system prompt, so it does not count towards its budget
+        prompt, estimated = enforce_input_budget(prompt, sys_prompt if ARK_API_KEY else None)
+    except PromptTooLarge as e:
+        logger.error(f"Rejecting LLM request before sending: {e}")
+        raise HTTPException(status_code=413, detail=f"Prompt too large: {e}")
+    logger.info(f"Estimated LLM input: {estimated} tokens")
+
+    if hedge is None:
+        hedge = LLM_HEDGE_ENABLED
+    if hedge and ARK_API_KEY and DEEPSEEK_API_KEY:
+        ark_model = model or DEFAULT_ARK_MODEL
+        secondary_model = LLM_HEDGE_SECONDARY_MODEL or DEFAULT_ORIGINAL_MODEL
+        logger.info(f"Calling Ark LLM ({ark_model}) hedged with original LLM ({secondary_model})")
+        # Either provider may answer, so hedged responses are cached under one combined
+        # "ark+deepseek" key, separate from the single-provider entries
+        provider, hedged_model = "ark+deepseek", f"{ark_model}+{secondary_model}"
+        key = llm_cache_key(provider, hedged_model, sys_prompt, prompt, temperature) if use_cache else None
+        return await llm_singleflight.do(key, lambda: cached_llm_call(
+            provider, hedged_model, sys_prompt, prompt, temperature,
+            lambda: llm_hedger.call(
+                "ark", lambda: _call_ark_llm(prompt, ark_model, temperature, sys_prompt, priority),
+                "deepseek", lambda: _call_original_llm(prompt, secondary_model, temperature, priority, sys_prompt)),
+            use_cache))
+    elif ARK_API_KEY:
         logger.info("ARK_API_KEY found, using Ark LLM method.")
         effective_model = model or DEFAULT_ARK_MODEL
         logger.info(f"Calling Ark LLM with model: {effective_model}")
-        return await _call_ark_llm(prompt, effective_model, temperature, sys_prompt)
+        key = llm_cache_key("ark", effective_model, sys_prompt, prompt, temperature) if use_cache else None
+        return await llm_singleflight.do(key, lambda: cached_llm_call(
+            "ark", effective_model, sys_prompt, prompt, temperature,
+            lambda: _call_ark_llm(prompt, effective_model, temperature, sys_prompt, priority), use_cache))
     elif DEEPSEEK_API_KEY:
         logger.warning("ARK_API_KEY not found, falling back to original LLM method.")
         effective_model = model or DEFAULT_ORIGINAL_MODEL
         logger.info(f"Calling original LLM with model: {effective_model}")
-        # Original method doesn't support system prompt yet
-        return await _call_original_llm(prompt, effective_model, temperature)
+        # Original method doesn't support system prompt yet, so it is not part of the cache key
+        key = llm_cache_key("deepseek", effective_model, None, prompt, temperature) if use_cache else None
+        return await llm_singleflight.do(key, lambda: cached_llm_call(
+            "deepseek", effective_model, None, prompt, temperature,
+            lambda: _call_original_llm(prompt, effective_model, temperature, priority), use_cache))
     else:
         logger.error("Neither ARK_API_KEY nor DEEPSEEK_API_KEY are set.")
         raise HTTPException(status_code=500, detail="No LLM API Key configured.")
@@ -0,0 +1,91 @@
+"""
+应用级共享的 LLM 客户端
+
+每次调用都新建 OpenAI()/httpx.AsyncClient 会重复建立TLS连接，同步客户端还要在
+to_thread 中占用一个线程直到请求结束(最长30分钟)。这里为每个服务商各创建一个原生
+异步客户端，复用keep-alive连接池，连接数和超时可通过环境变量配置；应用启动时创建、
+关闭时释放，未启动时(如命令行脚本)首次使用时自动创建。
+"""
+import os
+import logging
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+ARK_API_KEY = os.getenv("ARK_API_KEY")
+ARK_BASE_URL = os.getenv("ARK_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+
+# 连接池与超时(秒)。生成整页HTML的长回复可能需要很久，读超时默认保持30分钟
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "1800"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "30"))
+DEEPSEEK_READ_TIMEOUT = float(os.getenv("DEEPSEEK_READ_TIMEOUT", "60"))
+
+
+def _limits():
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY)
+
+
+def _timeout(read):
+    return httpx.Timeout(connect=LLM_CONNECT_TIMEOUT, read=read, write=LLM_CONNECT_TIMEOUT, pool=LLM_POOL_TIMEOUT)
+
+
+class LLMClients:
+    """
+    各服务商的共享异步客户端。
+
+    ark(): Ark 平台(OpenAI 兼容接口)的 AsyncOpenAI 客户端
+    deepseek(): 调用 DeepSeek 接口的 httpx.AsyncClient
+    """
+
+    def __init__(self):
+        self._ark = None
+        self._deepseek = None
+
+    def start(self):
+        """应用启动时预先创建已配置了密钥的服务商客户端"""
+        if ARK_API_KEY:
+            self.ark()
+        if DEEPSEEK_API_KEY:
+            self.deepseek()
+
+    def ark(self):
+        if self._ark is None:
+            if not ARK_API_KEY:
+                raise ValueError("ARK_API_KEY environment variable must be set.")
+            self._ark = AsyncOpenAI(
+                api_key=ARK_API_KEY,
+                base_url=ARK_BASE_URL,
+                timeout=_timeout(LLM_READ_TIMEOUT),
+                max_retries=0,  # 重试由 llm_governor 负责
+                http_client=DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout(LLM_READ_TIMEOUT)),
+            )
+            logger.info(f"已创建 Ark LLM 客户端 (最大连接数 {LLM_MAX_CONNECTIONS})")
+        return self._ark
+
+    def deepseek(self):
+        if self._deepseek is None:
+            self._deepseek = httpx.AsyncClient(limits=_limits(), timeout=_timeout(DEEPSEEK_READ_TIMEOUT))
+            logger.info(f"已创建 DeepSeek LLM 客户端 (最大连接数 {LLM_MAX_CONNECTIONS})")
+        return self._deepseek
+
+    async def close(self):
+        """应用关闭时释放连接池"""
+        ark, self._ark = self._ark, None
+        deepseek, self._deepseek = self._deepseek, None
+        if ark is not None:
+            await ark.close()
+        if deepseek is not None:
+            await deepseek.aclose()
+
+
+llm_clients = LLMClients()
@@ -0,0 +1,327 @@
+"""
+LLM 调用调控器
+
+突发流量下所有请求同时打到服务商，换来一片429，最终以HTTP 500返回给用户。
+这里为每个 (服务商, 模型) 维护一个调控器：
+- 令牌桶限制请求速率，信号量(并发上限)限制在途请求数；
+- 超过并发上限的请求进入按优先级排序的等待队列，交互请求先于后台请求；
+- 429、5xx 和连接错误按带抖动的指数退避重试，优先使用服务商给出的 Retry-After；
+- 并发上限按 AIMD 自适应：请求顺利时缓慢加一，遇到429或延迟明显变长时减半(或小幅下调)。
+当前上限、在途数和队列长度可通过 governor_stats() 查看。
+"""
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# 优先级：数值越小越先获得并发名额
+PRIORITY_INTERACTIVE = 0  # 用户正在等待的生成
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2        # 批量/后台任务
+
+LLM_GOVERNOR_CONCURRENCY = float(os.getenv("LLM_GOVERNOR_CONCURRENCY", "8"))  # 初始并发上限
+LLM_GOVERNOR_MIN_CONCURRENCY = float(os.getenv("LLM_GOVERNOR_MIN_CONCURRENCY", "1"))
+LLM_GOVERNOR_MAX_CONCURRENCY = float(os.getenv("LLM_GOVERNOR_MAX_CONCURRENCY", "32"))
+LLM_GOVERNOR_RPS = float(os.getenv("LLM_GOVERNOR_RPS", "5"))  # 令牌桶速率(请求/秒)
+LLM_GOVERNOR_BURST = float(os.getenv("LLM_GOVERNOR_BURST", "10"))  # 令牌桶容量
+LLM_GOVERNOR_QUEUE_TIMEOUT = float(os.getenv("LLM_GOVERNOR_QUEUE_TIMEOUT", "120"))  # 排队超时(秒)
+# 延迟超过基线(滑动平均)的此倍数时视为服务商过载，小幅下调并发上限
+LLM_GOVERNOR_LATENCY_FACTOR = float(os.getenv("LLM_GOVERNOR_LATENCY_FACTOR", "3"))
+LLM_GOVERNOR_DECREASE_COOLDOWN = float(os.getenv("LLM_GOVERNOR_DECREASE_COOLDOWN", "2"))  # 两次下调的最小间隔(秒)
+LLM_RETRY_MAX = int(os.getenv("LLM_RETRY_MAX", "3"))  # 最大重试次数
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))  # 退避基数(秒)
+LLM_RETRY_CAP = float(os.getenv("LLM_RETRY_CAP", "20"))  # 单次退避上限(秒)
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def _parse_overrides(value):
+    """解析 "ark=16:10,deepseek=4:2" 形式的覆盖配置：{服务商或服务商/模型: (并发上限, 每秒请求数)}"""
+    overrides = {}
+    for item in value.split(","):
+        name, _, limits = item.partition("=")
+        if not name.strip() or not limits.strip():
+            continue
+        concurrency, _, rps = limits.partition(":")
+        overrides[name.strip()] = (float(concurrency), float(rps) if rps.strip() else LLM_GOVERNOR_RPS)
+    return overrides
+
+
+LLM_GOVERNOR_OVERRIDES = _parse_overrides(os.getenv("LLM_GOVERNOR_OVERRIDES", ""))
+
+
+class LLMBusy(Exception):
+    """服务商持续限流或排队超时，应以503返回，提示稍后重试"""
+
+
+def classify_error(exc):
+    """
+    判断错误是否值得重试。
+    返回 (可重试, 是否为限流(429), Retry-After秒数或None)
+    """
+    import httpx
+    import openai
+
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None)
+    if status is None and isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+    if status is not None:
+        retry_after = None
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            try:
+                retry_after = float(headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        return status in RETRYABLE_STATUS, status == 429, retry_after
+    if isinstance(exc, (httpx.TransportError, openai.APIConnectionError)):
+        return True, False, None
+    return False, False, None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """第 attempt 次重试前的等待时间：全抖动指数退避，服务商给出 Retry-After 时以其为下限"""
+    delay = random.uniform(0, min(LLM_RETRY_CAP, LLM_RETRY_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, LLM_RETRY_CAP))
+    return delay
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，最多允许 burst 个突发"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+    @property
+    def tokens(self):
+        with self._lock:
+            return min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+
+
+class Governor:
+    """
+    单个 (服务商, 模型) 的调控器。
+
+    call(fn, priority) 在获得并发名额和令牌后 await fn()，可重试的错误按退避重试，
+    每次重试都重新排队；hold(fn, priority) 用于流式请求，整个流读取期间占用名额。
+    所有状态只在事件循环中访问，不需要加锁。
+    """
+
+    def __init__(self, name, concurrency=LLM_GOVERNOR_CONCURRENCY, rate=LLM_GOVERNOR_RPS, burst=LLM_GOVERNOR_BURST,
+                 min_concurrency=LLM_GOVERNOR_MIN_CONCURRENCY, max_concurrency=LLM_GOVERNOR_MAX_CONCURRENCY,
+                 queue_timeout=LLM_GOVERNOR_QUEUE_TIMEOUT):
+        self.name = name
+        self.min_concurrency = max(1.0, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = min(self.max_concurrency, max(self.min_concurrency, concurrency))
+        self.bucket = TokenBucket(rate, burst)
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = []  # 堆：[优先级, 序号, future]，已取消的条目在出队时跳过
+        self._seq = itertools.count()
+        self._baseline = {}  # 调用类型 -> 延迟滑动平均(秒)
+        self._last_decrease = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.queue_timeouts = 0
+        self.increases = 0
+        self.decreases = 0
+
+    # --- 并发名额 ---
+
+    def _capacity(self):
+        return max(1, int(self.limit))
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self._capacity():
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        if self.in_flight < self._capacity() and not self.queued:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, [priority, next(self._seq), future])
+            try:
+                await asyncio.wait_for(future, self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.queue_timeouts += 1
+                raise LLMBusy(f"{self.name} 排队超过 {self.queue_timeout:.0f}s")
+            except BaseException:
+                # 名额已分配但等待方被取消，归还名额
+                if future.done() and not future.cancelled():
+                    self.release()
+                raise
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    @property
+    def queued(self):
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    # --- AIMD ---
+
+    def _on_success(self, latency, kind):
+        baseline = self._baseline.get(kind)
+        self._baseline[kind] = latency if baseline is None else baseline * 0.9 + latency * 0.1
+        if baseline is not None and latency > baseline * LLM_GOVERNOR_LATENCY_FACTOR:
+            self._decrease(0.9, f"延迟 {latency:.1f}s 超过基线 {baseline:.1f}s 的 {LLM_GOVERNOR_LATENCY_FACTOR:g} 倍")
+        elif self.limit < self.max_concurrency and (self.in_flight >= self._capacity() or self.queued):
+            # 加性增长：上限被用满时，大约每完成 limit 个请求上限加一
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.increases += 1
+            self._wake()
+
+    def _on_throttled(self):
+        self.throttled += 1
+        self._decrease(0.5, "服务商返回429")
+
+    def _decrease(self, factor, reason):
+        # 同一批并发请求几乎同时遇到限流，冷却期内只下调一次
+        now = time.monotonic()
+        if now - self._last_decrease < LLM_GOVERNOR_DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        self.decreases += 1
+        logger.warning(f"LLM调控器 {self.name}: {reason}，并发上限 {previous:.1f} -> {self.limit:.1f}")
+
+    # --- 调用 ---
+
+    def _retry_or_raise(self, exc, attempt):
+        """记录失败；需要重试时返回等待秒数，否则抛出"""
+        retryable, throttled, retry_after = classify_error(exc)
+        if throttled:
+            self._on_throttled()
+        if not retryable or attempt >= LLM_RETRY_MAX:
+            self.failures += 1
+            if throttled:
+                raise LLMBusy(f"{self.name} 持续限流，已重试 {attempt} 次: {exc}") from exc
+            raise exc
+        self.retries += 1
+        delay = backoff_delay(attempt, retry_after)
+        logger.warning(f"LLM调用 {self.name} 失败({exc})，{delay:.2f}s 后第 {attempt + 1} 次重试")
+        return delay
+
+    async def _call(self, fn, priority, kind, keep_slot):
+        attempt = 0
+        while True:
+            await self.acquire(priority)
+            self.requests += 1
+            start = time.monotonic()
+            try:
+                result = await fn()
+            except Exception as e:
+                self.release()
+                delay = self._retry_or_raise(e, attempt)
+            except BaseException:
+                self.release()
+                raise
+            else:
+                self._on_success(time.monotonic() - start, kind)
+                if not keep_slot:
+                    self.release()
+                return result
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def call(self, fn, priority=PRIORITY_NORMAL):
+        """在调控下 await fn()，返回其结果"""
+        return await self._call(fn, priority, "call", keep_slot=False)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, fn, priority=PRIORITY_INTERACTIVE):
+        """
+        流式请求：在调控下 await fn() 打开流(只有打开流的请求会重试)，
+        退出上下文前一直占用并发名额。延迟按打开流(首字节)的耗时计。
+        """
+        stream = await self._call(fn, priority, "stream", keep_slot=True)
+        try:
+            yield stream
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "min_limit": self.min_concurrency,
+            "max_limit": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rate_per_second": self.bucket.rate,
+            "tokens": round(self.bucket.tokens, 2),
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "queue_timeouts": self.queue_timeouts,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "latency_baseline_s": {kind: round(v, 3) for kind, v in self._baseline.items()},
+        }
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(provider, model):
+    """返回 (服务商, 模型) 对应的调控器，首次使用时按覆盖配置或默认值创建"""
+    name = f"{provider}/{model}"
+    with _governors_lock:
+        governor = _governors.get(name)
+        if governor is None:
+            concurrency, rate = LLM_GOVERNOR_OVERRIDES.get(
+                name, LLM_GOVERNOR_OVERRIDES.get(provider, (LLM_GOVERNOR_CONCURRENCY, LLM_GOVERNOR_RPS)))
+            governor = _governors[name] = Governor(name, concurrency=concurrency, rate=rate)
+        return governor
+
+
+def governor_stats():
+    with _governors_lock:
+        governors = list(_governors.values())
+    return {governor.name: governor.stats() for governor in governors}
@@ -0,0 +1,193 @@
+"""
+跨服务商的对冲请求
+
+单个服务商的长尾延迟决定了我们的p99。开启对冲后，主服务商(Ark)的调用在
+"最近延迟的某个分位数"内还没有返回时，把同一个请求再发给备用服务商(DeepSeek)，
+采用先返回的结果并取消另一个；主服务商直接出错时立即改用备用服务商。
+
+每个服务商维护一个延迟直方图(对数分桶，按时间窗口滚动，只反映最近的延迟)，
+对冲延迟取主服务商直方图的 LLM_HEDGE_PERCENTILE 分位数，并限制在
+[LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MAX_DELAY] 之间；样本不足时使用 LLM_HEDGE_DEFAULT_DELAY。
+"""
+import os
+import math
+import time
+import bisect
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") in ("1", "true", "True")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))  # 秒
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "60"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_SECONDARY_MODEL = os.getenv("LLM_HEDGE_SECONDARY_MODEL")  # 默认使用备用服务商的默认模型
+LLM_LATENCY_WINDOW = float(os.getenv("LLM_LATENCY_WINDOW", "600"))  # 直方图的滚动窗口(秒)
+
+# 延迟分桶上界(秒)：50ms 起每桶约乘以 1.41，最后一桶约 20 分钟，超出的计入溢出桶
+LATENCY_BUCKETS = [round(0.05 * 2 ** (i / 2), 3) for i in range(30)]
+
+
+class LatencyHistogram:
+    """
+    对数分桶的延迟直方图。
+    保留当前和上一个时间窗口的计数，分位数基于这两个窗口，较早的样本自然淘汰。
+    """
+
+    def __init__(self, window=LLM_LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._current = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._previous = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._rotated = time.monotonic()
+        self.total = 0
+
+    def _rotate(self):
+        now = time.monotonic()
+        elapsed = now - self._rotated
+        if elapsed < self.window:
+            return
+        # 超过两个窗口没有样本时上一个窗口也已过期
+        self._previous = self._current if elapsed < 2 * self.window else [0] * len(self._current)
+        self._current = [0] * len(self._current)
+        self._rotated = now
+
+    def observe(self, seconds):
+        with self._lock:
+            self._rotate()
+            self._current[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.total += 1
+
+    def _counts(self):
+        self._rotate()
+        return [a + b for a, b in zip(self._current, self._previous)]
+
+    def count(self):
+        with self._lock:
+            return sum(self._counts())
+
+    def percentile(self, q):
+        """最近延迟的 q 分位数(所在桶的上界，秒)，没有样本时返回None"""
+        with self._lock:
+            counts = self._counts()
+        total = sum(counts)
+        if not total:
+            return None
+        target = max(1, math.ceil(q / 100 * total))
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= target:
+                return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+
+    def stats(self):
+        with self._lock:
+            counts = self._counts()
+        buckets = {}
+        for index, count in enumerate(counts):
+            if count:
+                label = f"<={LATENCY_BUCKETS[index]}s" if index < len(LATENCY_BUCKETS) else f">{LATENCY_BUCKETS[-1]}s"
+                buckets[label] = count
+        return {
+            "recent": sum(counts),
+            "total": self.total,
+            "p50_s": self.percentile(50),
+            "p90_s": self.percentile(90),
+            "p99_s": self.percentile(99),
+            "buckets": buckets,
+        }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def latency_histogram(provider):
+    with _histograms_lock:
+        histogram = _histograms.get(provider)
+        if histogram is None:
+            histogram = _histograms[provider] = LatencyHistogram()
+        return histogram
+
+
+def record_latency(provider, seconds):
+    """记录一次成功调用的延迟，所有调用路径都会记录，不只是对冲请求"""
+    latency_histogram(provider).observe(seconds)
+
+
+def hedge_delay(provider):
+    """主服务商调用多久没有返回时发出对冲请求(秒)"""
+    histogram = latency_histogram(provider)
+    if histogram.count() < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return min(LLM_HEDGE_MAX_DELAY, max(LLM_HEDGE_MIN_DELAY, histogram.percentile(LLM_HEDGE_PERCENTILE)))
+
+
+class Hedger:
+    """发起对冲请求并统计：对冲次数、备用服务商胜出次数、主服务商出错后的切换次数"""
+
+    def __init__(self):
+        self.calls = 0
+        self.hedged = 0
+        self.secondary_wins = 0
+        self.failovers = 0
+
+    async def call(self, primary_name, primary, secondary_name, secondary):
+        """
+        await primary()，超过对冲延迟仍未返回时同时 await secondary()，返回先成功的结果，
+        另一个调用被取消。两个都失败时抛出主服务商的错误。
+        """
+        self.calls += 1
+        delay = hedge_delay(primary_name)
+        first = asyncio.ensure_future(primary())
+        tasks = {first: primary_name}
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done and first.exception() is None:
+                return first.result()
+            if done:
+                self.failovers += 1
+                logger.warning(f"{primary_name} 调用失败({first.exception()})，改用 {secondary_name}")
+            else:
+                self.hedged += 1
+                logger.info(f"{primary_name} 超过 {delay:.2f}s 未返回，向 {secondary_name} 发出对冲请求")
+            second = asyncio.ensure_future(secondary())
+            tasks[second] = secondary_name
+
+            pending = {task for task in tasks if not task.done()}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.secondary_wins += 1
+                        logger.info(f"对冲请求由 {tasks[task]} 先返回")
+                        return task.result()
+            raise first.exception() or second.exception()
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    def stats(self):
+        with _histograms_lock:
+            providers = list(_histograms)
+        return {
+            "enabled": LLM_HEDGE_ENABLED,
+            "percentile": LLM_HEDGE_PERCENTILE,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "secondary_wins": self.secondary_wins,
+            "failovers": self.failovers,
+            "hedge_delay_s": {provider: round(hedge_delay(provider), 3) for provider in providers},
+            "latency": {provider: latency_histogram(provider).stats() for provider in providers},
+        }
+
+
+llm_hedger = Hedger()
@@ -1,8 +1,12 @@
 import os
+import asyncio
 import logging
-from openai import OpenAI
 from dotenv import load_dotenv
 from .prompt_config import SYSTEM_PROMPT_WEB_DESIGNER, USER_PROMPT_WEB_DESIGNER, SYSTEM_PROMPT_SUMMARIZE_2MD
+from .llm_clients import llm_clients
+from .llm_caller import generate_content_with_llm
+from .llm_governor import PRIORITY_INTERACTIVE, get_governor
+from .llm_tokens import enforce_input_budget, max_tokens_kwargs, token_usage
 import re
 
 # Load environment variables from a .env file if present
@@ -14,72 +18,117 @@ logger = logging.getLogger(__name__)
 
 
 
-def call_ark_llm(prompt: str, sys_prompt:str = SYSTEM_PROMPT_WEB_DESIGNER,model_id: str = "deepseek-v3-250324", temperature: float = 0.7) -> str:
+def call_ark_llm(prompt: str, sys_prompt:str = SYSTEM_PROMPT_WEB_DESIGNER,model_id: str = "deepseek-v3-250324", temperature: float = 0.7, use_cache: bool = True) -> str:
     """
-    Calls the Ark platform LLM using the OpenAI client library.
+    Calls the Ark platform LLM from synchronous code (scripts, this module's demo).
+
+    A thin wrapper around llm_caller.generate_content_with_llm, so it shares the
+    web app's single Ark call path: token budget, response cache, governor and the
+    pooled AsyncOpenAI client from llm_clients. The call runs in a fresh event loop
+    and the pooled clients are closed afterwards; inside a running event loop
+    await generate_content_with_llm instead.
 
     Args:
         prompt (str): The user prompt to send to the LLM.
-        model_id (str): The model ID to use (e.g., "deepseek-r1-250120").
-                        Defaults to "deepseek-r1-250120".
+        sys_prompt (str): The system prompt.
+        model_id (str): The Ark model ID to use.
         temperature (float): Controls randomness. Lower is more deterministic.
                              Defaults to 0.7.
+        use_cache (bool): Return a cached response for an identical request.
+                          Pass False to get a fresh sample (the cache is still updated).
 
     Returns:
         str: The content of the LLM's response message.
 
     Raises:
         ValueError: If the ARK_API_KEY environment variable is not set.
-        Exception: If the API call fails.
+        HTTPException: If the prompt exceeds the token budget or the API call fails.
     """
-    api_key = os.environ.get("ARK_API_KEY")
-    # Use the provided base_url or default to the one in the example
-    base_url = os.environ.get("ARK_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
-
-    if not api_key:
+    if not os.environ.get("ARK_API_KEY"):
         logger.error("ARK_API_KEY environment variable not found.")
         raise ValueError("ARK_API_KEY environment variable must be set.")
 
-    try:
-        client = OpenAI(
-            api_key=api_key,
-            base_url=base_url,
-            # Set a long timeout as recommended for potentially long-running models
-            timeout=1800.0, # 1800 seconds = 30 minutes
-        )
-        
-        logger.info(f"Sending request to Ark LLM. Model: {model_id}, Temperature: {temperature}")
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=[
-                # You can add a system prompt here if needed:
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature,
-            # Add other parameters like max_tokens if necessary
-            # max_tokens=1024,
-        )
-
-        message = response.choices[0].message
-
-        # Check for and log reasoning content if the model provides it
-        if hasattr(message, 'reasoning_content') and message.reasoning_content:
-            logger.info("LLM Reasoning Content Detected:")
-            # You might want to print this or handle it differently
-            print("--- Reasoning Content ---")
-            print(message.reasoning_content)
-            print("--- End Reasoning Content ---")
-
-
-        content = message.content
-        logger.info("Successfully received response from Ark LLM.")
-        return content
-
-    except Exception as e:
-        logger.error(f"Error during Ark LLM API call: {e}", exc_info=True)
-        # Re-raise the exception to be handled by the caller
-        raise Exception(f"Failed to get response from Ark LLM: {e}")
+    async def run():
+        try:
+            return await generate_content_with_llm(prompt, model=model_id, temperature=temperature,
+                                                   sys_prompt=sys_prompt, use_cache=use_cache, hedge=False)
+        finally:
+            await llm_clients.close()
+
+    return asyncio.run(run())
+
+async def stream_ark_llm(prompt: str, sys_prompt: str = SYSTEM_PROMPT_WEB_DESIGNER, model_id: str = "deepseek-v3-250324", temperature: float = 0.7, priority: int = PRIORITY_INTERACTIVE):
+    """
+    Streams the Ark LLM response, yielding content deltas as they arrive.
+
+    Closing the generator early (e.g. breaking out of `async for` inside
+    contextlib.aclosing) closes the underlying HTTP stream, so the model stops
+    generating tokens nobody will read.
+
+    The stream holds one of the governor's concurrency slots until it is closed;
+    only opening the stream is retried. The input budget is checked before the
+    stream is opened (raises PromptTooLarge); token usage is recorded when the
+    stream is closed, estimated from the received text if it ended early.
+    """
+    prompt, estimated = enforce_input_budget(prompt, sys_prompt)
+    client = llm_clients.ark()
+    logger.info(f"Streaming request to Ark LLM. Model: {model_id}, Temperature: {temperature}")
+    open_stream = lambda: client.chat.completions.create(
+        model=model_id,
+        messages=[
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=temperature,
+        stream=True,
+        # The final chunk carries the usage of the whole response
+        stream_options={"include_usage": True},
+        **max_tokens_kwargs(),
+    )
+    async with get_governor("ark", model_id).hold(open_stream, priority) as stream:
+        parts = []
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            await stream.close()
+            token_usage.record("ark", model_id, estimated, usage, "".join(parts))
+
+# 完整的HTML文档：从<!DOCTYPE>或<html>开始到</html>结束
+COMPLETE_HTML_PATTERN = re.compile(r'(?:<!DOCTYPE\s+html[^>]*>|<html[^>]*>)[\s\S]*?</html>', re.IGNORECASE)
+
+class HtmlStreamCollector:
+    """
+    累积流式响应，一旦出现完整的HTML文档就返回它，调用方随即停止读取。
+    只在新内容中出现 </html> 时才做一次完整匹配，避免每个片段都扫描全文。
+    """
+
+    def __init__(self):
+        self.parts = []
+        self._tail = ""
+        self.html = None
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def feed(self, delta):
+        """追加一个片段，返回完整的HTML文档，尚未完整时返回None"""
+        self.parts.append(delta)
+        window = self._tail + delta
+        self._tail = window[-len("</html>"):]
+        if self.html is None and "</html>" in window.lower():
+            match = COMPLETE_HTML_PATTERN.search(self.text)
+            if match:
+                self.html = match.group(0)
+        return self.html
 
 def extract_html_from_response(response_text):
     """
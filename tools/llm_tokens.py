@@ -0,0 +1,157 @@
+"""
+本地 token 估算与用量统计
+
+不依赖服务商的分词器，用字符类别粗略估计 token 数：中日韩字符约每字 1 个 token，
+其他字符(英文、数字、标点、空白)约每 4 个字符 1 个 token。用于在发起请求前判断
+输入是否过长、该如何切分，估计值偏保守即可。
+
+每次LLM调用前按 LLM_MAX_INPUT_TOKENS 检查输入(系统提示词 + 用户提示词)，超出预算时
+按 LLM_INPUT_BUDGET_POLICY 拒绝或截断用户提示词，不发起任何网络请求；
+LLM_MAX_OUTPUT_TOKENS 大于0时作为 max_tokens 传给服务商。
+调用完成后记录服务商返回的 usage(没有时记录估计值)，可通过 token_usage.stats() 查看。
+"""
+import os
+import re
+import math
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+LLM_MAX_INPUT_TOKENS = int(os.getenv("LLM_MAX_INPUT_TOKENS", "48000"))  # 0表示不限制
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "0"))  # 0表示使用服务商默认值
+LLM_INPUT_BUDGET_POLICY = os.getenv("LLM_INPUT_BUDGET_POLICY", "reject")  # reject: 拒绝；truncate: 截断用户提示词
+TRUNCATION_MARKER = "\n\n[内容过长，已截断]"
+
+
+def estimate_tokens(text):
+    """估计文本的 token 数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class PromptTooLarge(ValueError):
+    """输入超出 token 预算，在发起请求前拒绝"""
+
+    def __init__(self, estimated, budget):
+        super().__init__(f"输入约 {estimated} tokens，超过预算 {budget} tokens")
+        self.estimated = estimated
+        self.budget = budget
+
+
+def truncate_to_tokens(text, max_tokens):
+    """保留文本开头，使估计的 token 数不超过 max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 估计值随长度单调增加，二分查找能保留的最大字符数
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def enforce_input_budget(prompt, sys_prompt=None, max_input_tokens=None, policy=None):
+    """
+    检查 系统提示词 + 用户提示词 是否超出输入预算，在发起请求前调用。
+
+    返回:
+        (可能被截断的用户提示词, 估计的输入 token 数)
+    异常:
+        PromptTooLarge: 超出预算且策略为 reject，或只有系统提示词就已超出预算
+    """
+    max_input_tokens = LLM_MAX_INPUT_TOKENS if max_input_tokens is None else max_input_tokens
+    policy = policy or LLM_INPUT_BUDGET_POLICY
+    system_tokens = estimate_tokens(sys_prompt)
+    estimated = system_tokens + estimate_tokens(prompt)
+    if max_input_tokens <= 0 or estimated <= max_input_tokens:
+        return prompt, estimated
+
+    available = max_input_tokens - system_tokens - estimate_tokens(TRUNCATION_MARKER)
+    if policy != "truncate" or available <= 0:
+        token_usage.record_rejected()
+        raise PromptTooLarge(estimated, max_input_tokens)
+    truncated = truncate_to_tokens(prompt, available) + TRUNCATION_MARKER
+    token_usage.record_truncated()
+    logger.warning(f"LLM输入约 {estimated} tokens 超过预算 {max_input_tokens}，用户提示词已截断")
+    return truncated, system_tokens + estimate_tokens(truncated)
+
+
+def max_tokens_kwargs(max_output_tokens=None):
+    """请求参数中的输出上限：配置了 LLM_MAX_OUTPUT_TOKENS 时返回 {"max_tokens": n}"""
+    max_output_tokens = LLM_MAX_OUTPUT_TOKENS if max_output_tokens is None else max_output_tokens
+    return {"max_tokens": max_output_tokens} if max_output_tokens > 0 else {}
+
+
+def _usage_value(usage, name):
+    if usage is None:
+        return None
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return int(value) if value is not None else None
+
+
+class TokenUsage:
+    """
+    按 服务商/模型 累计的 token 用量。
+    prompt_tokens/completion_tokens 优先取服务商返回的 usage，没有时(如提前关闭的流)
+    用本地估计值代替并计入 estimated_responses；estimated_prompt_tokens 是发起请求前的
+    估计值，与服务商的计数对比可以看出估计的偏差。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self.rejected = 0
+        self.truncated = 0
+
+    def record(self, provider, model, estimated_prompt_tokens, usage=None, completion_text=None):
+        prompt_tokens = _usage_value(usage, "prompt_tokens")
+        completion_tokens = _usage_value(usage, "completion_tokens")
+        estimated = prompt_tokens is None or completion_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = estimated_prompt_tokens
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(completion_text)
+        with self._lock:
+            entry = self._models.setdefault(f"{provider}/{model}", {
+                "requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "estimated_prompt_tokens": 0, "estimated_responses": 0,
+            })
+            entry["requests"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["estimated_prompt_tokens"] += estimated_prompt_tokens
+            entry["estimated_responses"] += estimated
+        logger.info(f"LLM用量 {provider}/{model}: 输入 {prompt_tokens} tokens (估计 {estimated_prompt_tokens})，"
+                    f"输出 {completion_tokens} tokens{' (估计值)' if estimated else ''}")
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def record_truncated(self):
+        with self._lock:
+            self.truncated += 1
+
+    def stats(self):
+        with self._lock:
+            models = {name: {**entry, "total_tokens": entry["prompt_tokens"] + entry["completion_tokens"]}
+                      for name, entry in self._models.items()}
+            return {
+                "max_input_tokens": LLM_MAX_INPUT_TOKENS,
+                "max_output_tokens": LLM_MAX_OUTPUT_TOKENS,
+                "input_budget_policy": LLM_INPUT_BUDGET_POLICY,
+                "rejected": self.rejected,
+                "truncated": self.truncated,
+                "models": models,
+            }
+
+
+token_usage = TokenUsage()
@@ -0,0 +1,147 @@
+"""
+按内容寻址的卡片渲染缓存
+
+相同的HTML(模板卡片、重复粘贴的代码)在相同渲染参数下总是得到相同的卡片图片，
+因此以 HTML + 渲染参数的哈希为键，把最终的 _card.png 保存在磁盘上，
+按总大小上限做LRU淘汰，命中时无需再启动浏览器和运行提取。
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", os.path.join("output", "render_cache"))
+RENDER_CACHE_MAX_MB = float(os.getenv("RENDER_CACHE_MAX_MB", "512"))
+
+
+def cache_key(html_content, **params):
+    """HTML内容与渲染参数(宽度、像素比、提取参数等)共同决定的缓存键"""
+    h = hashlib.sha256()
+    h.update(html_content.encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class RenderCache:
+    """
+    磁盘上的LRU缓存，每个条目是一个 <key>.png 文件。
+
+    最近使用顺序通过文件的修改时间持久化，重启后从目录重建索引。
+
+    参数:
+        directory: 缓存目录
+        max_bytes: 缓存文件总大小上限，超出时淘汰最久未使用的条目
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIR, max_bytes=int(RENDER_CACHE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> 文件大小，按最近使用排序
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".png"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def fetch(self, key, dest_path):
+        """命中时把缓存的卡片放到 dest_path 并返回True，否则返回False"""
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return False
+            self._index.move_to_end(key)
+        path = self._path(key)
+        try:
+            os.utime(path)
+            _copy_atomic(path, dest_path)
+        except OSError as e:
+            logger.warning(f"读取渲染缓存失败 {key}: {e}")
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._bytes -= size
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, src_path):
+        """把生成好的卡片图片加入缓存"""
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"写入渲染缓存失败 {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._bytes += size - self._index.pop(key, 0)
+            self._index[key] = size
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def _copy_atomic(src, dst):
+    """
+    复制缓存条目到 dst(先写临时文件再替换)。不使用硬链接：
+    之后对 dst 的原地写入(如重新渲染同一 file_id)会同时改掉缓存条目。
+    """
+    tmp_path = f"{dst}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
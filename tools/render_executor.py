@@ -0,0 +1,103 @@
+"""
+渲染执行器
+
+Selenium 渲染和 OpenCV 提取都是阻塞调用，直接在 async 路由里执行会卡住整个
+uvicorn worker。这里用独立的线程池运行渲染任务，并用有界队列限制排队数量，
+async 路由只需 await submit(...)。队列深度和等待时间可通过 stats() 查看。
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .browser_pool import RENDER_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 默认并发数与浏览器池大小一致，多出的线程只会在借出浏览器时空等
+RENDER_CONCURRENCY = int(os.getenv("RENDER_CONCURRENCY", str(RENDER_POOL_SIZE)))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "32"))
+
+
+class RenderQueueFull(Exception):
+    """排队中的渲染任务已达上限"""
+
+
+class RenderExecutor:
+    """
+    带有界队列的渲染线程池。
+
+    参数:
+        concurrency: 同时执行的渲染任务数
+        max_queue: 最多允许排队(尚未开始执行)的任务数，超出时 submit 抛出 RenderQueueFull
+    """
+
+    def __init__(self, concurrency=RENDER_CONCURRENCY, max_queue=RENDER_QUEUE_SIZE):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="render")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._last_wait = 0.0
+
+    async def submit(self, fn, *args, **kwargs):
+        """在渲染线程池中执行 fn(*args, **kwargs) 并等待结果"""
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise RenderQueueFull(f"渲染队列已满 ({self.max_queue})")
+            self._queued += 1
+            self._submitted += 1
+        enqueued_at = time.monotonic()
+
+        def job():
+            wait = time.monotonic() - enqueued_at
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+                self._last_wait = wait
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    if not ok:
+                        self._failed += 1
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, job)
+
+    def stats(self):
+        with self._lock:
+            started = self._submitted - self._queued
+            return {
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 1) if started else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 1),
+                "last_wait_ms": round(self._last_wait * 1000, 1),
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,97 @@
+"""
+页面渲染就绪检测
+
+替代固定的 time.sleep：依次等待 document.readyState、document.fonts.ready、
+所有图片解码完成，以及一段短暂的网络空闲窗口，并设置硬超时。
+返回结果中记录了结束等待的条件和各阶段耗时，便于按负载调参。
+"""
+import os
+import logging
+
+from selenium.common.exceptions import TimeoutException
+
+logger = logging.getLogger(__name__)
+
+RENDER_READY_TIMEOUT = float(os.getenv("RENDER_READY_TIMEOUT", "5"))  # 秒
+RENDER_NETWORK_IDLE_MS = int(os.getenv("RENDER_NETWORK_IDLE_MS", "150"))
+# 视口调整为内容高度后再次等待的硬超时(秒)：新进入视口的懒加载图片、字体
+RENDER_RESIZE_READY_TIMEOUT = float(os.getenv("RENDER_RESIZE_READY_TIMEOUT", "1"))
+
+# 结束等待的原因
+READY_NETWORK_IDLE = "network_idle"  # 所有条件均已满足
+READY_TIMEOUT = "timeout"            # 达到硬超时，waiting_for 为当时仍在等待的条件
+READY_ERROR = "error"
+
+READY_SCRIPT = """
+const done = arguments[arguments.length - 1];
+const idleMs = arguments[0];
+const timeoutMs = arguments[1];
+const t0 = performance.now();
+const stages = {};
+let waitingFor = 'ready_state';
+let finished = false;
+
+function elapsed() { return Math.round(performance.now() - t0); }
+function finish(reason, error) {
+    if (finished) return;
+    finished = true;
+    done({reason: reason, waiting_for: reason === 'network_idle' ? null : waitingFor,
+          elapsed_ms: elapsed(), stages: stages, error: error || null});
+}
+function mark(name, next) { stages[name] = elapsed(); waitingFor = next; }
+
+function networkIdle() {
+    return new Promise(resolve => {
+        let count = performance.getEntriesByType('resource').length;
+        let last = performance.now();
+        const tick = () => {
+            const n = performance.getEntriesByType('resource').length;
+            if (n !== count) { count = n; last = performance.now(); }
+            if (performance.now() - last >= idleMs) resolve();
+            else setTimeout(tick, Math.min(50, idleMs));
+        };
+        tick();
+    });
+}
+
+setTimeout(() => finish('timeout'), timeoutMs);
+
+const loaded = document.readyState === 'complete'
+    ? Promise.resolve()
+    : new Promise(r => window.addEventListener('load', r, {once: true}));
+
+loaded
+    .then(() => { mark('ready_state', 'fonts'); return document.fonts ? document.fonts.ready : null; })
+    .then(() => {
+        mark('fonts', 'images');
+        return Promise.all(Array.from(document.images).map(
+            img => img.decode ? img.decode().catch(() => null) : null));
+    })
+    .then(() => { mark('images', 'network_idle'); return networkIdle(); })
+    .then(() => { mark('network_idle', null); finish('network_idle'); })
+    .catch(e => finish('error', String(e)));
+"""
+
+
+def wait_for_render_ready(driver, timeout=RENDER_READY_TIMEOUT, idle_ms=RENDER_NETWORK_IDLE_MS):
+    """
+    等待当前页面渲染就绪。
+
+    参数:
+        driver: 已加载页面的 WebDriver
+        timeout: 硬超时(秒)
+        idle_ms: 网络空闲窗口(毫秒)，期间没有新的资源加载完成即视为空闲
+
+    返回:
+        dict，包含 reason (network_idle/timeout/error)、waiting_for、elapsed_ms 和各阶段完成时间 stages
+    """
+    # 给 WebDriver 留出余量，正常情况下由页面内的计时器先触发超时
+    driver.set_script_timeout(timeout + 1)
+    try:
+        result = driver.execute_async_script(READY_SCRIPT, idle_ms, int(timeout * 1000))
+    except TimeoutException:
+        result = {"reason": READY_TIMEOUT, "waiting_for": None,
+                  "elapsed_ms": int(timeout * 1000), "stages": {}, "error": None}
+    logger.info(f"页面就绪: {result['reason']} ({result['elapsed_ms']}ms), 阶段: {result['stages']}"
+                + (f", 等待中: {result['waiting_for']}" if result.get("waiting_for") else ""))
+    return result
@@ -0,0 +1,270 @@
+"""
+进程隔离的渲染 worker
+
+长时间运行的 Chrome 会泄漏内存，卡死的页面也会拖垮整个请求。这里把渲染放到一组
+独立的 worker 进程中，每个进程持有自己的浏览器：
+- 渲染次数达到上限或内存(RSS)超过阈值后回收重建 worker；
+- worker 崩溃或任务超时时强制结束并自动重启，正在执行的任务在新 worker 上重试一次。
+
+每个 worker 是独立进程组的组长，chromedriver 和 Chrome 都在这个进程组中；
+强制结束时结束整个进程组，不会留下孤儿浏览器进程。
+"""
+import os
+import signal
+import queue
+import logging
+import threading
+import multiprocessing
+
+try:
+    import psutil
+except ImportError:  # psutil 可选，缺失时从 /proc 统计进程树的内存
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0"))  # 0 表示不使用进程隔离，在线程中渲染
+RENDER_WORKER_MAX_RENDERS = int(os.getenv("RENDER_WORKER_MAX_RENDERS", "200"))
+RENDER_WORKER_MAX_RSS_MB = float(os.getenv("RENDER_WORKER_MAX_RSS_MB", "1536"))
+RENDER_JOB_TIMEOUT = float(os.getenv("RENDER_JOB_TIMEOUT", "60"))  # 秒
+
+
+class RenderWorkerError(Exception):
+    """worker 崩溃或超时，重试后仍然失败"""
+
+
+class RenderJobError(Exception):
+    """渲染任务本身出错(如页面无法渲染)，不会重试"""
+
+
+def _rss_mb():
+    """当前进程及其子进程(chromedriver/Chrome)的常驻内存，单位MB"""
+    if psutil is not None:
+        proc = psutil.Process()
+        total = proc.memory_info().rss
+        for child in proc.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / (1024 * 1024)
+    try:
+        return _proc_tree_rss(os.getpid()) / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+def _proc_tree_rss(root_pid):
+    """没有 psutil 时遍历 /proc，按父进程关系累加 root_pid 及其所有子孙进程的RSS(字节)"""
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    children = {}
+    rss = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # comm 字段可能含空格，从最后一个右括号之后解析：state ppid ...
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{name}/statm") as f:
+                pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue  # 进程已退出
+        rss[int(name)] = pages * page_size
+        children.setdefault(ppid, []).append(int(name))
+    total = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, ()))
+    return total
+
+
+def _worker_main(conn):
+    """worker 进程入口：持有一个浏览器，循环执行父进程发来的渲染任务"""
+    if hasattr(os, "setsid"):
+        # 成为新进程组的组长，之后启动的 chromedriver/Chrome 都在这个进程组中
+        os.setsid()
+    from .browser_pool import BrowserPool
+    from .selenium2img import render_card_to_file
+
+    # 单个浏览器的池，复用其健康检查和按次数/时间回收的逻辑
+    pool = BrowserPool(size=1)
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+            html_content, card_image_path, options = job
+            try:
+                result = render_card_to_file(html_content, card_image_path, pool=pool, **options)
+                conn.send(("ok", result, _rss_mb()))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}", _rss_mb()))
+    finally:
+        pool.close()
+
+
+class _Worker:
+    def __init__(self, ctx, index):
+        self.index = index
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,),
+                                   name=f"render-worker-{index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.renders = 0
+        self.rss_mb = 0.0
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        """强制结束 worker 及其 chromedriver/Chrome 子进程"""
+        descendants = []
+        if psutil is not None and self.process.is_alive():
+            try:
+                descendants = psutil.Process(self.process.pid).children(recursive=True)
+            except psutil.Error:
+                pass
+        if hasattr(os, "killpg"):
+            # worker 已经退出时进程组中可能还有孤儿浏览器进程，同样要结束
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+        # 离开了进程组的子进程(如 Chrome 自己新建会话的进程)
+        for child in descendants:
+            try:
+                child.kill()
+            except psutil.Error:
+                pass
+        self.conn.close()
+
+
+class RenderWorkerPool:
+    """
+    渲染 worker 进程池。render_card 为阻塞调用，应在线程中调用(如 RenderExecutor)。
+
+    参数:
+        size: worker 进程数
+        max_renders: 单个 worker 最多渲染次数，达到后回收
+        max_rss_mb: worker(含浏览器子进程)内存上限，超过后回收
+        job_timeout: 单个任务的超时时间(秒)，超时视为卡死
+    """
+
+    def __init__(self, size=RENDER_WORKERS, max_renders=RENDER_WORKER_MAX_RENDERS,
+                 max_rss_mb=RENDER_WORKER_MAX_RSS_MB, job_timeout=RENDER_JOB_TIMEOUT):
+        self.size = max(1, size)
+        self.max_renders = max_renders
+        self.max_rss_mb = max_rss_mb
+        self.job_timeout = job_timeout
+        # spawn：不从已有线程的父进程 fork，避免继承锁和事件循环状态
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_index = 0
+        self._closed = False
+        self.crashes = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.recycled = 0
+
+    def _spawn(self):
+        with self._lock:
+            index = self._next_index
+            self._next_index += 1
+        return _Worker(self._ctx, index)
+
+    def start(self):
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+        logger.info(f"已启动 {self.size} 个渲染 worker 进程")
+
+    def _run_once(self, worker, job, timeout):
+        """在指定 worker 上执行任务；worker 崩溃或超时时抛出 RenderWorkerError"""
+        try:
+            worker.conn.send(job)
+            if not worker.conn.poll(timeout):
+                self.timeouts += 1
+                raise RenderWorkerError(f"渲染超时 ({timeout}s), worker {worker.index}")
+            status, payload, rss_mb = worker.conn.recv()
+        except (EOFError, OSError, BrokenPipeError) as e:
+            self.crashes += 1
+            raise RenderWorkerError(f"worker {worker.index} 已崩溃: {e}")
+        worker.renders += 1
+        worker.rss_mb = rss_mb
+        if status == "error":
+            raise RenderJobError(payload)
+        return payload
+
+    def _replace(self, worker, reason):
+        logger.warning(f"重启渲染 worker {worker.index}: {reason}")
+        worker.kill()
+        return self._spawn()
+
+    def _checkin(self, worker):
+        if self._closed:
+            worker.stop()
+            return
+        if worker.renders >= self.max_renders or worker.rss_mb >= self.max_rss_mb:
+            logger.info(f"回收渲染 worker {worker.index} (渲染 {worker.renders} 次, 内存 {worker.rss_mb:.0f}MB)")
+            self.recycled += 1
+            worker.stop()
+            worker = self._spawn()
+        self._idle.put(worker)
+
+    def render_card(self, html_content, card_image_path, timeout=None, **options):
+        """
+        在 worker 进程中执行 selenium2img.render_card_to_file，返回其结果。
+        worker 崩溃或超时时在新 worker 上重试一次。
+        """
+        if self._closed:
+            raise RuntimeError("渲染 worker 池已关闭")
+        timeout = self.job_timeout if timeout is None else timeout
+        job = (html_content, card_image_path, options)
+        worker = self._idle.get()
+        try:
+            try:
+                return self._run_once(worker, job, timeout)
+            except RenderWorkerError as e:
+                worker = self._replace(worker, e)
+                self.retries += 1
+            try:
+                return self._run_once(worker, job, timeout)
+            except RenderWorkerError as e:
+                worker = self._replace(worker, e)
+                raise
+        finally:
+            self._checkin(worker)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "crashes": self.crashes,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "recycled": self.recycled,
+        }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
@@ -1,10 +1,186 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-import time
 import os
-from .card_extractor import extract_card_from_image
+import base64
+import cv2
+import numpy as np
+from .card_extractor import extract_card, extract_card_from_image, limit_output_size
+from .card_encoder import save_card_variants
+from .browser_pool import IPHONE15_WIDTH, IPHONE15_HEIGHT, create_driver, set_device_metrics
+from .render_ready import RENDER_READY_TIMEOUT, RENDER_NETWORK_IDLE_MS, RENDER_RESIZE_READY_TIMEOUT, wait_for_render_ready
 
-def html_to_image(html_path, output_path, width=393, height=None):
+# 全页截图方式
+CAPTURE_RESIZE = "resize"        # 运行时把视口高度调整为内容高度后截图
+CAPTURE_FULL_PAGE = "full_page"  # 视口不变，直接截取超出视口的整页内容
+CAPTURE_ELEMENT = "element"      # 只截取页面中卡片元素的区域，找不到卡片时退回整页截图
+
+# 卡片区域四周保留的边距(CSS像素)
+CARD_CLIP_PADDING = int(os.getenv("CARD_CLIP_PADDING", "8"))
+# 卡片元素的最小面积(CSS像素的平方)，过滤掉图标、分隔线等小块；
+# 与 OpenCV 提取的 min_area(截图像素中的轮廓面积)不是同一个参数
+CARD_ELEMENT_MIN_AREA = int(os.getenv("CARD_ELEMENT_MIN_AREA", "10000"))
+
+PAGE_HEIGHT_SCRIPT = """
+    return Math.max(
+        document.body.scrollHeight, 
+        document.documentElement.scrollHeight,
+        document.body.offsetHeight, 
+        document.documentElement.offsetHeight,
+        document.body.clientHeight,
+        document.documentElement.clientHeight
+    );
+"""
+
+# 查找卡片元素的文档坐标：优先使用指定的选择器，否则取最外层的可见内容块
+# (有背景、边框或阴影，且不是铺满整页的外层容器)，多个并列内容块取并集
+CARD_BOX_SCRIPT = """
+const selector = arguments[0];
+const minArea = arguments[1];
+const docWidth = document.documentElement.scrollWidth;
+const docHeight = document.documentElement.scrollHeight;
+
+function visible(el) {
+    const s = getComputedStyle(el);
+    if (s.display === 'none' || s.visibility === 'hidden' || parseFloat(s.opacity) === 0) return false;
+    const r = el.getBoundingClientRect();
+    return r.width > 0 && r.height > 0;
+}
+function boxed(el) {
+    const s = getComputedStyle(el);
+    const bg = s.backgroundColor;
+    return (bg && bg !== 'transparent' && !/rgba\\(.*,\\s*0\\)$/.test(bg))
+        || s.backgroundImage !== 'none'
+        || s.boxShadow !== 'none'
+        || parseFloat(s.borderTopWidth) > 0 || parseFloat(s.borderLeftWidth) > 0;
+}
+function box(el) {
+    const r = el.getBoundingClientRect();
+    return {x: r.left + window.scrollX, y: r.top + window.scrollY, width: r.width, height: r.height};
+}
+
+if (selector) {
+    const el = document.querySelector(selector);
+    return el && visible(el) ? box(el) : null;
+}
+
+const found = [];
+const queue = Array.from(document.body ? document.body.children : []);
+while (queue.length) {
+    const el = queue.shift();
+    if (!visible(el)) continue;
+    const b = box(el);
+    const fillsPage = b.width >= docWidth * 0.98 && b.height >= docHeight * 0.98;
+    if (!fillsPage && b.width * b.height >= minArea && boxed(el)) {
+        found.push(b);
+        continue;
+    }
+    queue.push(...el.children);
+}
+if (!found.length) return null;
+
+let x0 = Infinity, y0 = Infinity, x1 = -Infinity, y1 = -Infinity;
+for (const b of found) {
+    x0 = Math.min(x0, b.x); y0 = Math.min(y0, b.y);
+    x1 = Math.max(x1, b.x + b.width); y1 = Math.max(y1, b.y + b.height);
+}
+return {x: x0, y: y0, width: x1 - x0, height: y1 - y0};
+"""
+
+def capture_clip(driver, x, y, width, height):
+    """通过 CDP 截取文档中 (x, y, width, height) (CSS像素) 的区域，返回PNG字节"""
+    result = driver.execute_cdp_cmd("Page.captureScreenshot", {
+        "format": "png",
+        "captureBeyondViewport": True,
+        "clip": {"x": x, "y": y, "width": width, "height": height, "scale": 1},
+    })
+    return base64.b64decode(result["data"])
+
+def capture_full_page(driver, width, height):
+    """通过 CDP 截取 width x height (CSS像素) 的整页区域，返回PNG字节"""
+    return capture_clip(driver, 0, 0, width, height)
+
+def find_card_box(driver, selector=None, padding=CARD_CLIP_PADDING, min_area=CARD_ELEMENT_MIN_AREA):
+    """
+    在页面中查找卡片元素的区域。
+
+    返回:
+        加上边距并限制在文档范围内的 (x, y, width, height)，单位为CSS像素；没有合适的元素时返回None
+    """
+    b = driver.execute_script(CARD_BOX_SCRIPT, selector, min_area)
+    if not b or b["width"] <= 0 or b["height"] <= 0:
+        return None
+    doc_w, doc_h = driver.execute_script(
+        "return [document.documentElement.scrollWidth, document.documentElement.scrollHeight];")
+    x0 = max(0, b["x"] - padding)
+    y0 = max(0, b["y"] - padding)
+    x1 = min(doc_w, b["x"] + b["width"] + padding)
+    y1 = min(doc_h, b["y"] + b["height"] + padding)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+def set_document_content(driver, html_content):
+    """不经过文件系统，直接把HTML字符串设置为当前页面内容"""
+    driver.get("about:blank")
+    frame_id = driver.execute_cdp_cmd("Page.getFrameTree", {})["frameTree"]["frame"]["id"]
+    driver.execute_cdp_cmd("Page.setDocumentContent", {"frameId": frame_id, "html": html_content})
+
+def _render(driver, html_path=None, html_content=None, width=IPHONE15_WIDTH, height=None,
+            capture_mode=CAPTURE_RESIZE, ready_timeout=RENDER_READY_TIMEOUT,
+            network_idle_ms=RENDER_NETWORK_IDLE_MS, card_selector=None, element_min_area=CARD_ELEMENT_MIN_AREA):
+    """
+    在已启动的浏览器中加载一次页面并截图。
+
+    返回:
+        (PNG字节, info)，info 包含就绪检测结果 ready、调整视口后的就绪检测结果 resize_ready
+        和卡片区域 card_box (仅 CAPTURE_ELEMENT 模式且找到卡片元素时不为None)
+    """
+    info = {"ready": None, "resize_ready": None, "card_box": None}
+    set_device_metrics(driver, width, height or IPHONE15_HEIGHT)
+
+    # Load the page, either from a URL or straight from an HTML string
+    if html_content is not None:
+        set_document_content(driver, html_content)
+    else:
+        driver.get(html_path)
+    
+    # Wait for readyState, web fonts, image decode and a short network-idle window
+    info["ready"] = wait_for_render_ready(driver, ready_timeout, network_idle_ms)
+
+    if height is None:
+        # Calculate the full page height
+        height = driver.execute_script(PAGE_HEIGHT_SCRIPT)
+        print(f"自适应内容高度: {height}像素")
+        if capture_mode == CAPTURE_FULL_PAGE:
+            return capture_full_page(driver, width, height), info
+        # Resize the emulated viewport in place; no relaunch and no reload needed
+        set_device_metrics(driver, width, height)
+        # The taller viewport can trigger lazy-loaded images and fonts; wait briefly
+        # for them so the capture is not half-painted
+        info["resize_ready"] = wait_for_render_ready(
+            driver, min(ready_timeout, RENDER_RESIZE_READY_TIMEOUT), network_idle_ms)
+
+    if capture_mode == CAPTURE_ELEMENT:
+        # The browser already knows where the card is; clip to it instead of running OpenCV
+        info["card_box"] = find_card_box(driver, card_selector, min_area=element_min_area)
+        if info["card_box"] is not None:
+            print(f"卡片元素区域: {info['card_box']}")
+            return capture_clip(driver, *info["card_box"]), info
+
+    return driver.get_screenshot_as_png(), info
+
+def _render_with_driver(pool, **kwargs):
+    """从池中借出浏览器渲染；没有池时启动一次性浏览器并在结束后退出"""
+    if pool is not None:
+        with pool.driver() as driver:
+            return _render(driver, **kwargs)
+
+    # Initialize the driver with mobile emulation options
+    driver = create_driver(kwargs.get("width", IPHONE15_WIDTH), kwargs.get("height"))
+    try:
+        return _render(driver, **kwargs)
+    finally:
+        driver.quit()
+
+def html_to_image(html_path, output_path, width=IPHONE15_WIDTH, height=None, pool=None, capture_mode=CAPTURE_RESIZE,
+                  ready_timeout=RENDER_READY_TIMEOUT, network_idle_ms=RENDER_NETWORK_IDLE_MS, card_selector=None,
+                  element_min_area=CARD_ELEMENT_MIN_AREA):
     """
     Renders HTML file to an image using Selenium and Chrome, emulating a mobile device.
     
@@ -13,80 +189,87 @@ def html_to_image(html_path, output_path, width=393, height=None):
         output_path: Path to save the output image
         width: Width of the viewport in pixels (default: 393px - iPhone 15 width)
         height: Height of the viewport in pixels (None for auto, dynamically calculated)
+        pool: Optional BrowserPool to borrow a warm Chrome instance from;
+              without it a one-off browser is launched and quit afterwards
+        capture_mode: How the page is captured within a single page load,
+              CAPTURE_RESIZE (default), CAPTURE_FULL_PAGE or CAPTURE_ELEMENT
+        ready_timeout: Hard limit in seconds for the render readiness wait
+        network_idle_ms: Quiet window in milliseconds treated as network idle
+        card_selector: CSS selector of the card element for CAPTURE_ELEMENT;
+              None picks the outermost visible content block
+        element_min_area: Minimum card element area in CSS px² for CAPTURE_ELEMENT
     """
-    # Configure Chrome options
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")  # Run in headless mode
-    chrome_options.add_argument("--disable-gpu")
-    # Remove specific window size and user agent as mobile emulation handles this
-    # chrome_options.add_argument(f"--window-size={width},{height or 852}")
-    # chrome_options.add_argument("--user-agent=Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1")
-    chrome_options.add_argument("--hide-scrollbars")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--force-device-scale-factor=2") # Keep high DPI
-
-    # Define mobile emulation settings for iPhone 15
-    mobile_emulation = {
-        "deviceMetrics": {
-            "width": width,
-            "height": height or 852,  # Use a default height if not dynamic
-            "pixelRatio": 3.0 # iPhone 15 has a 3x pixel ratio
-        },
-        "userAgent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
-    }
-    chrome_options.add_experimental_option("mobileEmulation", mobile_emulation)
-    
+    # Convert to absolute path if it's a local file
+    if not html_path.startswith('http'):
+        html_path = 'file://' + os.path.abspath(html_path)
+
     try:
-        # Initialize the driver with mobile emulation options
-        driver = webdriver.Chrome(options=chrome_options)
-        
-        # Convert to absolute path if it's a local file
-        if not html_path.startswith('http'):
-            html_path = 'file://' + os.path.abspath(html_path)
-        
-        # Load the page
-        driver.get(html_path)
-        
-        # Wait for page rendering and any JavaScript execution
-        time.sleep(2)
-        
-        # Dynamically calculate height if needed
-        if height is None:
-            # Calculate the full page height
-            calculated_height = driver.execute_script("""
-                return Math.max(
-                    document.body.scrollHeight, 
-                    document.documentElement.scrollHeight,
-                    document.body.offsetHeight, 
-                    document.documentElement.offsetHeight,
-                    document.body.clientHeight,
-                    document.documentElement.clientHeight
-                );
-            """)
-            print(f"自适应内容高度: {calculated_height}像素")
-            
-            # Update mobile emulation height and re-initialize driver for correct height
-            # Note: Re-initializing is necessary because mobileEmulation height is set at launch
-            driver.quit() # Close the current driver
-            mobile_emulation["deviceMetrics"]["height"] = calculated_height
-            chrome_options.add_experimental_option("mobileEmulation", mobile_emulation)
-            driver = webdriver.Chrome(options=chrome_options) # Re-launch with correct height
-            driver.get(html_path) # Reload page
-            time.sleep(1) # Wait for reload
-
-        # Capture screenshot
-        driver.save_screenshot(output_path)
+        png, _ = _render_with_driver(
+            pool, html_path=html_path, width=width, height=height, capture_mode=capture_mode,
+            ready_timeout=ready_timeout, network_idle_ms=network_idle_ms, card_selector=card_selector,
+            element_min_area=element_min_area)
+        with open(output_path, "wb") as f:
+            f.write(png)
         print(f"Image saved to {output_path}")
         return True
     
     except Exception as e:
         print(f"Error converting HTML to image: {e}")
         return False
-    
-    finally:
-        if 'driver' in locals():
-            driver.quit()
+
+def render_html(html_content, width=IPHONE15_WIDTH, height=None, pool=None, capture_mode=CAPTURE_RESIZE,
+                ready_timeout=RENDER_READY_TIMEOUT, network_idle_ms=RENDER_NETWORK_IDLE_MS, card_selector=None,
+                element_min_area=CARD_ELEMENT_MIN_AREA):
+    """
+    Renders an HTML string in memory and returns (PNG bytes, info).
+
+    Same parameters as html_to_image, but nothing is read from or written to disk:
+    the document content is set directly and the screenshot comes back as base64.
+    info holds the readiness result and, for CAPTURE_ELEMENT, the card box that was
+    clipped (None when no element qualified and the whole page was captured).
+    Errors are raised to the caller instead of being swallowed.
+    """
+    return _render_with_driver(
+        pool, html_content=html_content, width=width, height=height, capture_mode=capture_mode,
+        ready_timeout=ready_timeout, network_idle_ms=network_idle_ms, card_selector=card_selector,
+        element_min_area=element_min_area)
+
+def decode_image(png):
+    """Decodes encoded image bytes into a BGR ndarray, as cv2.imread would"""
+    return cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+
+def render_card_to_file(html_content, card_image_path, pool=None, width=IPHONE15_WIDTH, card_selector=None,
+                        min_area=500, debug=None, element_min_area=CARD_ELEMENT_MIN_AREA):
+    """
+    Renders an HTML string in memory and saves only the final card image (plus its encoded variants).
+
+    The card is clipped by the browser using the card element's box; when no element
+    qualifies the OpenCV extractor runs on the full screenshot, and when that fails too
+    the full screenshot is saved as the card. element_min_area (CSS px²) filters card
+    elements in the page; min_area (screenshot px) is the OpenCV contour threshold. debug=None samples extractor debug
+    images at EXTRACT_DEBUG_SAMPLE_RATE. Returns whether a card was extracted;
+    rendering errors are raised.
+    """
+    png, info = render_html(html_content, width=width, pool=pool, capture_mode=CAPTURE_ELEMENT,
+                            card_selector=card_selector, element_min_area=element_min_area)
+    screenshot = decode_image(png)
+    if info["card_box"] is not None:
+        save_card_variants(card_image_path, screenshot, png_bytes=png)
+        return True
+
+    print(f"未找到卡片元素，使用OpenCV提取: {card_image_path}")
+    result = extract_card(screenshot, min_area=min_area, debug=debug,
+                          debug_name=os.path.splitext(os.path.basename(card_image_path))[0])
+    print(f"卡片提取诊断: {result.to_dict()}")
+    if result:
+        # result.card 是截图上的视图，直接编码，不经过中间文件
+        save_card_variants(card_image_path, result.card)
+        return True
+    print(f"卡片提取失败，使用原始图像作为备选: {card_image_path}")
+    # 整页截图可能很大，超过输出像素上限时缩小，此时截图的PNG编码不能直接使用
+    limited = limit_output_size(screenshot)
+    save_card_variants(card_image_path, limited, png_bytes=png if limited is screenshot else None)
+    return False
 
 # Only run example code when this file is executed directly, not when imported
 if __name__ == "__main__":
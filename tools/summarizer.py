@@ -0,0 +1,183 @@
+"""
+长文总结
+
+抓取的网页往往远超模型适合的上下文长度，整篇放进一个提示词会让调用很慢甚至失败。
+输入较短时仍一次总结；超过阈值时按 map-reduce 方式总结：
+- 按 Markdown 标题把全文切成不超过 SUMMARIZE_CHUNK_TOKENS 的片段，
+  过长的章节再按段落、行切分，续写的片段带上所属章节的标题；
+- 各片段在并发上限内并行提取要点(map)；
+- 要点合起来仍然过长时再切分、提取一轮，最后用 SYSTEM_PROMPT_SUMMARIZE_2MD 生成总结(reduce)。
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+
+from .llm_tokens import estimate_tokens
+from .llm_caller import generate_content_with_llm
+from .prompt_config import SYSTEM_PROMPT_SUMMARIZE_2MD
+
+logger = logging.getLogger(__name__)
+
+SUMMARIZE_SINGLE_SHOT_TOKENS = int(os.getenv("SUMMARIZE_SINGLE_SHOT_TOKENS", "12000"))  # 超过时使用 map-reduce
+SUMMARIZE_CHUNK_TOKENS = int(os.getenv("SUMMARIZE_CHUNK_TOKENS", "4000"))
+SUMMARIZE_MAP_CONCURRENCY = int(os.getenv("SUMMARIZE_MAP_CONCURRENCY", "4"))
+SUMMARIZE_MAX_ROUNDS = 3  # map 的最大轮数，防止要点始终压缩不下来时无限循环
+SUMMARIZE_TEMPERATURE = 0.5  # 使用较低的温度以获得更一致的总结
+
+SUMMARIZE_PROMPT = """请对以下内容进行简洁明了的总结，突出关键信息，保持语言简练：
+
+{content}
+
+总结：
+"""
+
+MAP_PROMPT = """以下是一篇长文的第 {index}/{total} 部分。请提取这一部分的关键信息、观点和数据，用简洁的要点列出，不要添加原文没有的内容：
+
+{content}
+
+要点：
+"""
+
+REDUCE_PROMPT = """以下是一篇长文各部分的要点，按原文顺序排列。请据此对全文进行简洁明了的总结，突出关键信息，保持语言简练：
+
+{content}
+
+总结：
+"""
+
+HEADING_PATTERN = re.compile(r'^#{1,6}\s', re.MULTILINE)
+
+
+def _sections(text):
+    """在每个 Markdown 标题行之前切开，标题和它的正文在同一段"""
+    starts = [m.start() for m in HEADING_PATTERN.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(text))
+    return [text[a:b] for a, b in zip(starts, starts[1:]) if text[a:b].strip()]
+
+
+def _hard_split(text, max_tokens):
+    """没有可用的分隔符时按字符数切分(按每字符一个 token 保守估计)"""
+    return [text[i:i + max_tokens] for i in range(0, len(text), max_tokens)]
+
+
+def _split_oversized(section, max_tokens):
+    """把超过上限的章节按段落、行、字符逐级切开，续写的片段带上章节标题"""
+    heading = section.split("\n", 1)[0] + "\n" if HEADING_PATTERN.match(section) else ""
+    budget = max(1, max_tokens - estimate_tokens(heading))
+    units = []
+    for paragraph in re.split(r'\n\s*\n', section[len(heading):]):
+        if estimate_tokens(paragraph) <= budget:
+            units.append(paragraph)
+            continue
+        for line in paragraph.split("\n"):
+            units.extend([line] if estimate_tokens(line) <= budget else _hard_split(line, budget))
+
+    pieces, current, current_tokens = [], [], 0
+    for unit in units:
+        if not unit.strip():
+            continue
+        tokens = estimate_tokens(unit) + 1  # 加上段落分隔符
+        if current and current_tokens + tokens > budget:
+            pieces.append(heading + "\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        pieces.append(heading + "\n\n".join(current))
+    return pieces
+
+
+def split_markdown(text, max_tokens=SUMMARIZE_CHUNK_TOKENS):
+    """
+    把 Markdown 文本切成估计不超过 max_tokens 的片段。
+    尽量在标题处切分，相邻的短章节合并到同一片段。
+    """
+    chunks, current, current_tokens = [], [], 0
+    for section in _sections(text):
+        tokens = estimate_tokens(section)
+        pieces = [section] if tokens <= max_tokens else _split_oversized(section, max_tokens)
+        for piece in pieces:
+            tokens = estimate_tokens(piece) + 1
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append("".join(current).strip())
+                current, current_tokens = [], 0
+            current.append(piece if piece.endswith("\n") else piece + "\n")
+            current_tokens += tokens
+    if current:
+        chunks.append("".join(current).strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+async def _map(chunks, model, use_cache, concurrency):
+    """并行提取各片段的要点，返回 (按原顺序的要点列表, 各片段耗时毫秒)"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies = [0.0] * len(chunks)
+
+    async def summarize_chunk(index, chunk):
+        async with semaphore:
+            started = time.monotonic()
+            notes = await generate_content_with_llm(
+                prompt=MAP_PROMPT.format(index=index + 1, total=len(chunks), content=chunk),
+                model=model, temperature=SUMMARIZE_TEMPERATURE, use_cache=use_cache)
+            latencies[index] = round((time.monotonic() - started) * 1000, 1)
+            return notes.strip()
+
+    notes = await asyncio.gather(*(summarize_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+    return list(notes), latencies
+
+
+async def summarize_text(content, model=None, use_cache=True, single_shot_tokens=SUMMARIZE_SINGLE_SHOT_TOKENS,
+                         chunk_tokens=SUMMARIZE_CHUNK_TOKENS, concurrency=SUMMARIZE_MAP_CONCURRENCY):
+    """
+    总结一段文本，估计长度不超过 single_shot_tokens 时一次总结，否则使用 map-reduce。
+
+    返回:
+        {"summary", "mode": "single"|"map_reduce", "input_tokens", "chunks", "rounds",
+         "timings": {"split_ms", "map_ms", "reduce_ms", "total_ms", "chunk_ms"}}
+    """
+    started = time.monotonic()
+    input_tokens = estimate_tokens(content)
+    result = {"mode": "single", "input_tokens": input_tokens, "chunks": 1, "rounds": 0, "timings": {}}
+    timings = result["timings"]
+
+    if input_tokens <= single_shot_tokens:
+        summary = await generate_content_with_llm(
+            prompt=SUMMARIZE_PROMPT.format(content=content), sys_prompt=SYSTEM_PROMPT_SUMMARIZE_2MD,
+            model=model, temperature=SUMMARIZE_TEMPERATURE, use_cache=use_cache)
+        timings["total_ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["summary"] = summary.strip()
+        return result
+
+    result["mode"] = "map_reduce"
+    chunks = split_markdown(content, chunk_tokens)
+    result["chunks"] = len(chunks)
+    timings["split_ms"] = round((time.monotonic() - started) * 1000, 1)
+    logger.info(f"长文总结: 约 {input_tokens} tokens，切分为 {len(chunks)} 个片段")
+
+    map_started = time.monotonic()
+    notes = chunks
+    timings["chunk_ms"] = []
+    while True:
+        notes, latencies = await _map(notes, model, use_cache, concurrency)
+        result["rounds"] += 1
+        timings["chunk_ms"].append(latencies)
+        combined = "\n\n".join(f"### 第{i + 1}部分\n{note}" for i, note in enumerate(notes))
+        if estimate_tokens(combined) <= single_shot_tokens or result["rounds"] >= SUMMARIZE_MAX_ROUNDS:
+            break
+        # 要点合起来仍然过长，对要点再切分、提取一轮
+        notes = split_markdown(combined, chunk_tokens)
+        logger.info(f"长文总结: 要点仍然过长，第 {result['rounds'] + 1} 轮切分为 {len(notes)} 个片段")
+    timings["map_ms"] = round((time.monotonic() - map_started) * 1000, 1)
+
+    reduce_started = time.monotonic()
+    summary = await generate_content_with_llm(
+        prompt=REDUCE_PROMPT.format(content=combined), sys_prompt=SYSTEM_PROMPT_SUMMARIZE_2MD,
+        model=model, temperature=SUMMARIZE_TEMPERATURE, use_cache=use_cache)
+    timings["reduce_ms"] = round((time.monotonic() - reduce_started) * 1000, 1)
+    timings["total_ms"] = round((time.monotonic() - started) * 1000, 1)
+    result["summary"] = summary.strip()
+    return result
@@ -0,0 +1,65 @@
+"""
+合成卡片截图生成器
+
+生成尺寸、卡片宽高比、背景噪声和内容块数量可控的截图，同时给出卡片的真实区域，
+用于对卡片提取做可重复的性能和准确率测试。相同参数和随机种子总是生成相同的图片。
+"""
+import cv2
+import numpy as np
+
+# 常见的卡片配色 (页面背景, 卡片背景)，BGR
+PALETTES = [
+    ((247, 247, 247), (255, 255, 255)),
+    ((235, 228, 240), (255, 255, 255)),
+    ((40, 40, 48), (62, 62, 74)),
+]
+BLOCK_COLORS = [(51, 51, 51), (102, 102, 102), (230, 120, 140), (240, 200, 170), (120, 90, 230)]
+
+
+def generate_card(width=1179, aspect=1.6, noise=0.0, blocks=8, margin=0.08, palette=0, seed=0):
+    """
+    生成一张含有一个卡片的截图。
+
+    参数:
+        width: 截图宽度(像素)
+        aspect: 卡片高宽比，截图高度随之确定
+        noise: 页面背景的高斯噪声标准差(灰度级)，0表示纯色背景
+        blocks: 卡片内的内容块数(文字行、色块交替)
+        margin: 卡片四周的页面边距，占截图宽度的比例
+        palette: PALETTES 中的配色序号
+        seed: 随机种子
+
+    返回:
+        (BGR图像, 卡片真实区域 (x, y, w, h))
+    """
+    rng = np.random.default_rng(seed)
+    page_color, card_color = PALETTES[palette % len(PALETTES)]
+    pad = int(width * margin)
+    card_w = width - 2 * pad
+    card_h = int(card_w * aspect)
+    height = card_h + 2 * pad
+
+    img = np.empty((height, width, 3), np.uint8)
+    img[:] = page_color
+    if noise > 0:
+        grain = rng.standard_normal((height, width, 1), dtype=np.float32) * noise
+        img = np.clip(img + grain, 0, 255).astype(np.uint8)
+
+    x0, y0 = pad, pad
+    cv2.rectangle(img, (x0, y0), (x0 + card_w - 1, y0 + card_h - 1), card_color, thickness=-1)
+
+    # 卡片内容：标题栏 + 若干文字行/色块，按内容块数等分卡片高度
+    inner = int(card_w * 0.06)
+    row_h = max(1, (card_h - 2 * inner) // max(1, blocks))
+    scale = max(0.4, width / 1200)
+    for i in range(blocks):
+        top = y0 + inner + i * row_h
+        color = BLOCK_COLORS[int(rng.integers(len(BLOCK_COLORS)))]
+        if i % 3 == 2:
+            right = x0 + inner + int((card_w - 2 * inner) * rng.uniform(0.4, 1.0))
+            cv2.rectangle(img, (x0 + inner, top + row_h // 5), (right, top + row_h * 4 // 5), color, thickness=-1)
+        else:
+            words = " ".join("card" * int(rng.integers(1, 3)) for _ in range(int(rng.integers(2, 6))))
+            cv2.putText(img, words, (x0 + inner, top + row_h * 2 // 3), cv2.FONT_HERSHEY_SIMPLEX,
+                        scale, color, max(1, int(2 * scale)), cv2.LINE_AA)
+    return img, (x0, y0, card_w, card_h)